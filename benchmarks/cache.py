@@ -0,0 +1,42 @@
+import threading
+from collections import Counter
+from django.core.cache.backends.locmem import LocMemCache
+
+
+class CountingLocMemCache(LocMemCache):
+    """
+    A local-memory cache that counts every call that would be a round trip to a real cache server.
+    The counter is shared between all instances. Calls made internally by another counted call, e.g. the
+    single ``get()`` calls performed by ``get_many()``, are not counted.
+    """
+    calls = Counter()
+    _active = threading.local()
+
+    def _count(name):
+        def method(self, *args, **kwargs):
+            if getattr(CountingLocMemCache._active, 'value', False):
+                return getattr(LocMemCache, name)(self, *args, **kwargs)
+            CountingLocMemCache.calls[name] += 1
+            CountingLocMemCache._active.value = True
+            try:
+                return getattr(LocMemCache, name)(self, *args, **kwargs)
+            finally:
+                CountingLocMemCache._active.value = False
+        method.__name__ = name
+        return method
+
+    get = _count('get')
+    get_many = _count('get_many')
+    set = _count('set')
+    set_many = _count('set_many')
+    add = _count('add')
+    delete = _count('delete')
+    delete_many = _count('delete_many')
+    incr = _count('incr')
+    touch = _count('touch')
+
+    del _count
+
+    @classmethod
+    def round_trips(cls) -> int:
+        return sum(cls.calls.values())
@@ -0,0 +1,75 @@
+"""
+Runs the benchmark scenarios against the test app models using SQLite and a local-memory cache. Usage::
+
+    python -m benchmarks.run [--repeat N] [--scale N] [scenario ...]
+
+For every scenario, the median duration of one iteration is reported together with the number of database
+queries and cache round trips it caused.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+
+def setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+
+def measure(scenario, scale, repeat):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    from benchmarks.cache import CountingLocMemCache
+
+    prepare, run = scenario.function(scale)
+    durations = []
+    queries = cache_round_trips = 0
+    for i in range(repeat):
+        arg = prepare()
+        CountingLocMemCache.calls.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            run(arg)
+            durations.append(time.perf_counter() - start)
+        queries = len(ctx.captured_queries)
+        cache_round_trips = CountingLocMemCache.round_trips()
+    return statistics.median(durations), queries, cache_round_trips
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run hierarkey benchmarks.')
+    parser.add_argument('scenarios', nargs='*', help='Names of scenarios to run, defaults to all.')
+    parser.add_argument('--repeat', type=int, default=20, help='Number of measured iterations per scenario.')
+    parser.add_argument('--scale', type=int, default=1, help='Factor for the amount of data per scenario.')
+    args = parser.parse_args(argv)
+
+    setup()
+    from benchmarks.scenarios import SCENARIOS
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error('Unknown scenarios: {}'.format(', '.join(sorted(unknown))))
+
+    print('{:<22} {:>12} {:>9} {:>13}  {}'.format('scenario', 'median', 'queries', 'cache trips', 'description'))
+    for name in args.scenarios or SCENARIOS:
+        scenario = SCENARIOS[name]
+        duration, queries, cache_round_trips = measure(scenario, args.scale, args.repeat)
+        print('{:<22} {:>10.3f}ms {:>9} {:>13}  {}'.format(
+            name, duration * 1000, queries, cache_round_trips, scenario.description
+        ))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Benchmark scenarios. Every scenario is a function taking a ``scale`` factor that sets up the required data and
+returns a ``(prepare, run)`` tuple. ``prepare()`` is called before every iteration and is not measured, its return
+value is passed to ``run()``, which is measured.
+"""
+from collections import OrderedDict, namedtuple
+from django import forms
+from django.core.cache import caches
+
+from hierarkey.forms import HierarkeyForm
+from tests.testapp.models import GlobalSettings, Organization, User
+
+Scenario = namedtuple('Scenario', ['name', 'description', 'function'])
+SCENARIOS = OrderedDict()
+
+
+def scenario(name, description):
+    def wrapper(function):
+        SCENARIOS[name] = Scenario(name, description, function)
+        return function
+    return wrapper
+
+
+def clear_caches():
+    for alias in ('default', 'local'):
+        caches[alias].clear()
+
+
+def create_organization(keys: int, value: str = 'value') -> Organization:
+    organization = Organization.objects.create(name='Benchmark')
+    organization._settings_objects.model.objects.bulk_create([
+        organization._settings_objects.model(object=organization, key='key_%d' % i, value=value)
+        for i in range(keys)
+    ])
+    organization.settings.flush()
+    return organization
+
+
+@scenario('get_cold', 'Read one key from a new instance, nothing cached')
+def get_cold(scale):
+    organization = create_organization(10 * scale)
+
+    def prepare():
+        clear_caches()
+        return Organization.objects.get(pk=organization.pk)
+
+    return prepare, lambda o: o.settings.get('key_1')
+
+
+@scenario('get_warm', 'Read one key from a new instance, values in the cache backend')
+def get_warm(scale):
+    organization = create_organization(10 * scale)
+
+    def prepare():
+        o = Organization.objects.get(pk=organization.pk)
+        o.settings.get('key_1')
+        return Organization.objects.get(pk=organization.pk)
+
+    return prepare, lambda o: o.settings.get('key_1')
+
+
+@scenario('get_repeated', 'Read one key 1000 times from the same instance')
+def get_repeated(scale):
+    organization = create_organization(10 * scale)
+
+    def prepare():
+        o = Organization.objects.get(pk=organization.pk)
+        o.settings.get('key_1')
+        return o
+
+    def run(o):
+        for i in range(1000):
+            o.settings.key_1
+
+    return prepare, run
+
+
+@scenario('get_inherited', 'Read 100 keys set on the global level from a new user instance')
+def get_inherited(scale):
+    organization = Organization.objects.create(name='Benchmark')
+    user = User.objects.create(organization=organization, name='Benchmark')
+    global_settings = GlobalSettings().settings
+    for i in range(100):
+        global_settings.set('global_%d' % i, 'value')
+
+    def prepare():
+        return User.objects.select_related('organization').get(pk=user.pk)
+
+    def run(u):
+        for i in range(100):
+            u.settings.get('global_%d' % i)
+
+    return prepare, run
+
+
+@scenario('freeze_wide', 'freeze() an object with 500 keys')
+def freeze_wide(scale):
+    organization = create_organization(500 * scale)
+
+    def prepare():
+        o = Organization.objects.get(pk=organization.pk)
+        o.settings.get('key_1')
+        return Organization.objects.get(pk=organization.pk)
+
+    return prepare, lambda o: o.settings.freeze()
+
+
+@scenario('freeze_large_values', 'freeze() an object with 50 keys holding 10 kB values')
+def freeze_large_values(scale):
+    organization = create_organization(50 * scale, value='x' * 10000)
+
+    def prepare():
+        o = Organization.objects.get(pk=organization.pk)
+        o.settings.get('key_1')
+        return Organization.objects.get(pk=organization.pk)
+
+    return prepare, lambda o: o.settings.freeze()
+
+
+@scenario('write_bulk', 'Write 100 keys one after another')
+def write_bulk(scale):
+    organization = create_organization(0)
+
+    def prepare():
+        return Organization.objects.get(pk=organization.pk)
+
+    def run(o):
+        for i in range(100 * scale):
+            o.settings.set('key_%d' % i, i)
+
+    return prepare, run
+
+
+@scenario('form_save', 'Save a HierarkeyForm with 20 changed fields')
+def form_save(scale):
+    organization = create_organization(0)
+    names = ['field_%d' % i for i in range(20 * scale)]
+    form_class = type('BenchmarkForm', (HierarkeyForm,), {name: forms.CharField(required=False) for name in names})
+    counter = [0]
+
+    def prepare():
+        counter[0] += 1
+        o = Organization.objects.get(pk=organization.pk)
+        form = form_class(obj=o, attribute_name='settings', data={
+            name: 'value %d' % counter[0] for name in names
+        })
+        assert form.is_valid()
+        return form
+
+    return prepare, lambda form: form.save()
+
+
+@scenario('list_n_plus_one', 'Read one key of each of 100 users in a list, values in the cache backend')
+def list_n_plus_one(scale):
+    organization = create_organization(10)
+    User.objects.bulk_create([User(organization=organization, name='User %d' % i) for i in range(100 * scale)])
+
+    def prepare():
+        for u in User.objects.select_related('organization').filter(organization=organization):
+            u.settings.get('key_1')
+        return list(User.objects.select_related('organization').filter(organization=organization))
+
+    def run(users):
+        for u in users:
+            u.settings.get('key_1')
+
+    return prepare, run
@@ -0,0 +1,11 @@
+from tests.settings import *  # NOQA
+
+CACHES = {
+    'default': {
+        'BACKEND': 'benchmarks.cache.CountingLocMemCache',
+    },
+    'local': {
+        'BACKEND': 'benchmarks.cache.CountingLocMemCache',
+        'LOCATION': 'local',
+    },
+}
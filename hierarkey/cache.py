@@ -0,0 +1,314 @@
+from typing import Callable, Dict, Iterator, List, Optional
+
+import hashlib
+import struct
+import sys
+import time
+import zlib
+from collections.abc import MutableMapping
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+
+from hierarkey import stats
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+_zstd_errors = (zstandard.ZstdError,) if zstandard is not None else ()
+
+RAW = 0
+ZLIB = 1
+ZSTD = 2
+
+_header = struct.Struct('>BII')
+_value_header = struct.Struct('>BI')
+
+
+class CompactCodec:
+    """
+    Encodes the values cached for one object into a compact binary format. This is useful if you store many
+    or large values per object and want to reduce the amount of data transferred from your cache backend.
+
+    All keys are stored once in a key table, values larger than ``compress_threshold`` bytes are compressed
+    individually. Every encoded entry starts with a format version byte, entries that cannot be decoded are
+    treated as a cache miss.
+
+    :param compress_threshold: Values of at least this many bytes (after UTF-8 encoding) are compressed.
+    :param compression: ``"zlib"`` or ``"zstd"``. The latter requires the ``zstandard`` package.
+    :param level: The compression level passed to the compressor.
+    """
+    version = 1
+
+    def __init__(self, compress_threshold: int = 512, compression: str = 'zlib', level: int = 6):
+        if compression not in ('zlib', 'zstd'):
+            raise ImproperlyConfigured('Unknown compression method "%s".' % compression)
+        if compression == 'zstd' and zstandard is None:
+            raise ImproperlyConfigured('The zstandard package needs to be installed to use zstd compression.')
+        self.compress_threshold = compress_threshold
+        self.compression = compression
+        self.level = level
+
+    def _compress(self, value: bytes):
+        if self.compression == 'zstd':
+            return ZSTD, zstandard.ZstdCompressor(level=self.level).compress(value)
+        return ZLIB, zlib.compress(value, self.level)
+
+    def encode(self, data: Dict[str, str]) -> bytes:
+        keytable = '\x00'.join(data.keys()).encode()
+        parts = [_header.pack(self.version, len(data), len(keytable)), keytable]
+        for value in data.values():
+            method, value = RAW, value.encode()
+            if len(value) >= self.compress_threshold:
+                compressed_method, compressed = self._compress(value)
+                if len(compressed) < len(value):
+                    method, value = compressed_method, compressed
+            parts.append(_value_header.pack(method, len(value)))
+            parts.append(value)
+        return b''.join(parts)
+
+    def decode(self, payload) -> Optional[Dict[str, str]]:
+        if not isinstance(payload, bytes) or len(payload) < _header.size or payload[0] != self.version:
+            return None
+        try:
+            return self._decode(payload)
+        except (struct.error, zlib.error, UnicodeDecodeError, *_zstd_errors):
+            # Truncated or otherwise corrupted entries are treated as a cache miss
+            return None
+
+    def _decode(self, payload: bytes) -> Optional[Dict[str, str]]:
+        _, count, keytable_length = _header.unpack_from(payload)
+        offset = _header.size + keytable_length
+        keys = payload[_header.size:offset].decode().split('\x00') if count else []
+        if len(keys) != count:
+            return None
+        data = {}
+        for key in keys:
+            method, length = _value_header.unpack_from(payload, offset)
+            offset += _value_header.size
+            value = payload[offset:offset + length]
+            if len(value) != length:
+                return None
+            offset += length
+            if method == ZLIB:
+                value = zlib.decompress(value)
+            elif method == ZSTD:
+                if zstandard is None:  # pragma: no cover
+                    return None
+                value = zstandard.ZstdDecompressor().decompress(value)
+            data[sys.intern(key)] = value.decode()
+        return data
+
+
+# Namespace versions are re-read from the cache backend at most this often (in seconds) per process
+VERSION_CHECK_INTERVAL = 1.0
+_versions = {}
+
+
+def _version_key(prefix: str, namespace: str) -> str:
+    return '{}_{}_version'.format(prefix, namespace)
+
+
+def namespace_version(alias: str, prefix: str, namespace: str) -> int:
+    """
+    Returns the current version of a cache namespace, which is part of the cache keys of all objects within the
+    namespace.
+    """
+    key = _version_key(prefix, namespace)
+    now = time.monotonic()
+    known = _versions.get((alias, key))
+    if known is not None and now - known[1] < VERSION_CHECK_INTERVAL:
+        return known[0]
+    backend = caches[alias]
+    version = backend.get(key)
+    if version is None:
+        # Start from the current time instead of 1, so that entries written before the version was evicted from
+        # the cache do not become valid again
+        backend.add(key, time.time_ns(), timeout=None)
+        version = backend.get(key)
+    _versions[alias, key] = (version, now)
+    return version
+
+
+def bump_namespace_version(alias: str, prefix: str, namespace: str) -> int:
+    """
+    Increases the version of a cache namespace, which makes all cache entries within the namespace unreachable.
+    They are removed by the cache backend once they expire.
+    """
+    key = _version_key(prefix, namespace)
+    backend = caches[alias]
+    try:
+        version = backend.incr(key)
+    except ValueError:
+        backend.add(key, time.time_ns(), timeout=None)
+        version = backend.incr(key)
+    _versions[alias, key] = (version, time.monotonic())
+    return version
+
+
+def shard_cache_keys(base_key: str, shards: int) -> List[str]:
+    """
+    Returns the cache keys of all buckets of a sharded cache entry.
+    """
+    return ['{}_s{}'.format(base_key, i) for i in range(shards)]
+
+
+class _LargeValue:
+    __slots__ = ('digest',)
+
+    def __init__(self, digest):
+        self.digest = digest
+
+
+class ShardedStore(MutableMapping):
+    """
+    A lazily loaded view on the values of one object that are spread across multiple cache entries. Keys are
+    assigned to ``shards`` buckets by their hash and buckets are only fetched from the cache once a key in them is
+    accessed. Values of at least ``large_value_threshold`` characters are not stored within their bucket, but in a
+    separate cache entry that is only fetched when the value is read.
+
+    If any bucket is missing from the cache, all values are loaded from the database and all buckets are written
+    to the cache again.
+
+    Values changed in buckets that have not been loaded yet are kept aside and applied on top of the bucket once it
+    is loaded, without writing them to the cache.
+    """
+
+    def __init__(self, backend, base_key: str, config, loader: Callable[..., Dict[str, str]], namespace: str = None):
+        self._backend = backend
+        self._namespace = namespace
+        self._base_key = base_key
+        self._config = config
+        self._loader = loader
+        self._buckets = {}
+        self._overlay = {}
+
+    def _bucket_index(self, key: str) -> int:
+        return zlib.crc32(key.encode()) % self._config.shards
+
+    def _bucket_key(self, index: int) -> str:
+        return '{}_s{}'.format(self._base_key, index)
+
+    def _value_key(self, digest: str) -> str:
+        return '{}_v_{}'.format(self._base_key, digest)
+
+    def _encode(self, data: Dict[str, str]):
+        return self._config.codec.encode(data) if self._config.codec else data
+
+    def _decode(self, payload) -> Optional[Dict[str, str]]:
+        if self._config.codec:
+            return self._config.codec.decode(payload)
+        return payload if isinstance(payload, dict) else None
+
+    def _decode_bucket(self, payload) -> Optional[dict]:
+        if not isinstance(payload, tuple) or len(payload) != 2:
+            return None
+        small, large = self._decode(payload[0]), self._decode(payload[1])
+        if small is None or large is None:
+            return None
+        small.update({key: _LargeValue(digest) for key, digest in large.items()})
+        return small
+
+    def _fill(self) -> None:
+        data = self._loader()
+        self._backend.set_many(self._entries(data), timeout=self._config.timeout)
+        self._buckets = {i: {} for i in range(self._config.shards)}
+        for key, value in data.items():
+            self._buckets[self._bucket_index(key)][key] = value
+        for key, value in self._overlay.items():
+            self._buckets[self._bucket_index(key)][key] = value
+        self._overlay = {}
+
+    def _loaded(self, index: int, bucket: dict) -> None:
+        for key in [k for k in self._overlay if self._bucket_index(k) == index]:
+            bucket[key] = self._overlay.pop(key)
+        self._buckets[index] = bucket
+
+    def _entries(self, data: Dict[str, str]) -> dict:
+        """
+        Returns all cache entries representing ``data``.
+        """
+        buckets = [({}, {}) for i in range(self._config.shards)]
+        entries = {}
+        threshold = self._config.large_value_threshold
+        for key, value in data.items():
+            small, large = buckets[self._bucket_index(key)]
+            if threshold and len(value) >= threshold:
+                digest = hashlib.sha1(value.encode()).hexdigest()
+                large[key] = digest
+                entries[self._value_key(digest)] = value
+            else:
+                small[key] = value
+        for i, (small, large) in enumerate(buckets):
+            entries[self._bucket_key(i)] = (self._encode(small), self._encode(large))
+        return entries
+
+    def _count(self, cache_key: str, hit: bool) -> None:
+        if stats.collectors:
+            stats.incr('cache_hit' if hit else 'cache_miss', self._namespace, cache_key=cache_key)
+
+    def _bucket(self, index: int) -> dict:
+        if index not in self._buckets:
+            bucket = self._decode_bucket(self._backend.get(self._bucket_key(index)))
+            self._count(self._bucket_key(index), bucket is not None)
+            if bucket is None:
+                self._fill()
+            else:
+                self._loaded(index, bucket)
+        return self._buckets[index]
+
+    def _load_all(self) -> None:
+        missing = [i for i in range(self._config.shards) if i not in self._buckets]
+        if not missing:
+            return
+        payloads = self._backend.get_many([self._bucket_key(i) for i in missing])
+        for i in missing:
+            bucket = self._decode_bucket(payloads.get(self._bucket_key(i)))
+            self._count(self._bucket_key(i), bucket is not None)
+            if bucket is None:
+                self._fill()
+                return
+            self._loaded(i, bucket)
+
+    def __getitem__(self, key: str) -> str:
+        bucket = self._bucket(self._bucket_index(key))
+        value = bucket[key]
+        if isinstance(value, _LargeValue):
+            cache_key = self._value_key(value.digest)
+            value = self._backend.get(cache_key)
+            self._count(cache_key, value is not None)
+            if value is None:
+                value = self._loader(keys=[key]).get(key)
+                if value is None:
+                    raise KeyError(key)
+                self._backend.set(self._value_key(hashlib.sha1(value.encode()).hexdigest()), value,
+                                  timeout=self._config.timeout)
+            bucket[key] = value
+        return value
+
+    def __contains__(self, key) -> bool:
+        return key in self._bucket(self._bucket_index(key))
+
+    def __setitem__(self, key: str, value: str) -> None:
+        index = self._bucket_index(key)
+        if index in self._buckets:
+            self._buckets[index][key] = value
+        else:
+            self._overlay[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        index = self._bucket_index(key)
+        if index in self._buckets:
+            self._buckets[index].pop(key, None)
+        else:
+            self._overlay.pop(key, None)
+
+    def __iter__(self) -> Iterator[str]:
+        self._load_all()
+        for bucket in list(self._buckets.values()):
+            yield from list(bucket)
+
+    def __len__(self) -> int:
+        self._load_all()
+        return sum(len(b) for b in self._buckets.values())
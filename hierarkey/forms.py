@@ -8,6 +8,7 @@ from django.utils.crypto import get_random_string
 from django.utils.text import normalize_newlines
 from django.utils.translation import gettext_lazy as _
 
+from hierarkey import tracing
 from hierarkey.models import BaseHierarkeyStoreModel
 
 logger = logging.getLogger(__name__)
@@ -43,12 +44,14 @@ class HierarkeyForm(forms.Form):
                 fname = self._s.get(name, as_type=File)
                 if fname and self.__file_is_last_reference(name, self._s.get(name, as_type=str)):
                     try:
-                        default_storage.delete(fname.name)
+                        with tracing.span('hierarkey.file_delete', path=fname.name):
+                            default_storage.delete(fname.name)
                     except OSError:  # pragma: no cover
                         logger.error('Deleting file %s failed.' % fname.name)
 
                 # Create new file
-                newname = default_storage.save(self.get_new_filename(value.name), value)
+                with tracing.span('hierarkey.file_save', path=value.name):
+                    newname = default_storage.save(self.get_new_filename(value.name), value)
                 value._name = newname
                 self._s.set(name, value)
             elif isinstance(value, File):
@@ -59,7 +62,8 @@ class HierarkeyForm(forms.Form):
                 fname = self._s.get(name, as_type=File)
                 if fname and self.__file_is_last_reference(name, self._s.get(name, as_type=str)):
                     try:
-                        default_storage.delete(fname.name)
+                        with tracing.span('hierarkey.file_delete', path=fname.name):
+                            default_storage.delete(fname.name)
                     except OSError:  # pragma: no cover
                         logger.error('Deleting file %s failed.' % fname.name)
                 del self._s[name]
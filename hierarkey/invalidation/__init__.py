@@ -0,0 +1,184 @@
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, router, transaction
+from django.db.models import F
+
+
+class LocalBroker:
+    """
+    Delivers invalidation messages to subscribers within the same process. This is useful for tests and for
+    deployments with only one process.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+
+    def publish(self, message: Tuple[str, Any, int]) -> None:
+        for callback in self._subscribers:
+            callback(message)
+
+    def subscribe(self, callback: Callable[[Tuple[str, Any, int]], None]) -> None:
+        self._subscribers.append(callback)
+
+
+class RedisBroker:
+    """
+    Delivers invalidation messages to all processes using Redis pub/sub. Requires the ``redis`` package.
+    Subscribing starts a daemon thread listening for messages.
+
+    :param url: The URL of the Redis server, e.g. ``redis://localhost:6379/0``.
+    :param channel: The name of the pub/sub channel to use.
+    """
+
+    def __init__(self, url: str, channel: str = 'hierarkey_invalidation'):
+        try:
+            import redis
+        except ImportError:  # pragma: no cover
+            raise ImproperlyConfigured('The redis package needs to be installed to use RedisBroker.')
+        self._client = redis.Redis.from_url(url)
+        self.channel = channel
+
+    def publish(self, message: Tuple[str, Any, int]) -> None:
+        self._client.publish(self.channel, json.dumps(message))
+
+    def subscribe(self, callback: Callable[[Tuple[str, Any, int]], None]) -> None:  # pragma: no cover
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+
+        def listen():
+            for message in pubsub.listen():
+                callback(tuple(json.loads(message['data'])))
+
+        threading.Thread(target=listen, name='hierarkey-invalidation', daemon=True).start()
+
+
+class GenerationTracker:
+    """
+    Keeps a generation counter for every object with a key-value store attached. The counter is increased
+    whenever values of the object are changed. Storage objects remember the generation their values have been
+    loaded at and reload them once they notice a newer generation, even if the change was made in a different
+    process.
+
+    :param cache_alias: The alias of a cache backend shared by all processes that holds the counters.
+    :param use_database: If ``True``, the counters are also stored in the database, so they survive evictions
+                         from the cache. Requires ``hierarkey.invalidation`` in your ``INSTALLED_APPS``.
+    :param broker: Optional. A broker like :py:class:`RedisBroker` that pushes changes to all processes
+                   immediately.
+    :param check_interval: The number of seconds a counter fetched from the cache is trusted before it is
+                           fetched again. Set to ``None`` to rely on the broker only.
+    :param prefix: A prefix for the cache keys of the counters.
+    :param max_known: The number of counters kept within the process. Once exceeded, the counters fetched or
+                      received the longest time ago are dropped and fetched from the cache again when needed.
+    """
+
+    def __init__(self, cache_alias: str = 'default', use_database: bool = False, broker=None,
+                 check_interval: Optional[float] = 1.0, prefix: str = 'hierarkey_gen', max_known: int = 10000):
+        self.cache_alias = cache_alias
+        self.use_database = use_database
+        self.broker = broker
+        self.check_interval = check_interval
+        self.prefix = prefix
+        self.max_known = max_known
+        self._known: Dict[Tuple[str, Any], Tuple[int, float]] = OrderedDict()
+        self._subscribed = False
+        self._lock = threading.Lock()
+
+    def _cache_key(self, namespace: str, pk: Any) -> str:
+        return '{}_{}_{}'.format(self.prefix, namespace, pk)
+
+    def _subscribe(self) -> None:
+        with self._lock:
+            if not self._subscribed:
+                self.broker.subscribe(self._receive)
+                self._subscribed = True
+
+    def _receive(self, message: Tuple[str, Any, int]) -> None:
+        namespace, pk, generation = message
+        self._remember(namespace, pk, generation)
+
+    def _remember(self, namespace: str, pk: Any, generation: int) -> None:
+        # Messages are received on the broker's thread
+        with self._lock:
+            self._known[namespace, pk] = (generation, time.monotonic())
+            self._known.move_to_end((namespace, pk))
+            while len(self._known) > self.max_known:
+                self._known.popitem(last=False)
+
+    def _fetch(self, namespace: str, pk: Any) -> int:
+        cache = caches[self.cache_alias]
+        key = self._cache_key(namespace, pk)
+        generation = cache.get(key)
+        if generation is None and self.use_database:
+            from .models import Generation
+
+            generation = Generation.objects.filter(namespace=namespace, object_pk=str(pk)).values_list(
+                'generation', flat=True
+            ).first()
+            if generation is not None:
+                cache.add(key, generation, timeout=None)
+        if generation is None:
+            # A counter that has been evicted must not start from a value a storage object might already have
+            # seen before, so we start from the current time.
+            cache.add(key, time.time_ns(), timeout=None)
+            generation = cache.get(key)
+        return generation
+
+    def current(self, namespace: str, pk: Any) -> int:
+        """
+        Returns the current generation of the given object.
+        """
+        if self.broker is not None and not self._subscribed:
+            self._subscribe()
+        known = self._known.get((namespace, pk))
+        if known is not None and (self.check_interval is None or time.monotonic() - known[1] < self.check_interval):
+            return known[0]
+        generation = self._fetch(namespace, pk)
+        self._remember(namespace, pk, generation)
+        return generation
+
+    def is_current(self, namespace: str, pk: Any, generation: Optional[int]) -> bool:
+        """
+        Returns whether values loaded at the given generation are still current.
+        """
+        return generation is not None and self.current(namespace, pk) == generation
+
+    def bump(self, namespace: str, pk: Any) -> int:
+        """
+        Increases the generation of the given object and returns the new generation.
+        """
+        cache = caches[self.cache_alias]
+        key = self._cache_key(namespace, pk)
+        if self.use_database:
+            generation = self._bump_database(namespace, pk)
+            cache.set(key, generation, timeout=None)
+        else:
+            try:
+                generation = cache.incr(key)
+            except ValueError:
+                cache.add(key, time.time_ns(), timeout=None)
+                generation = cache.incr(key)
+        self._remember(namespace, pk, generation)
+        if self.broker is not None:
+            self.broker.publish((namespace, pk, generation))
+        return generation
+
+    def _bump_database(self, namespace: str, pk: Any) -> int:
+        from .models import Generation
+
+        using = router.db_for_write(Generation)
+        qs = Generation.objects.using(using).filter(namespace=namespace, object_pk=str(pk))
+        with transaction.atomic(using=using):
+            if not qs.update(generation=F('generation') + 1):
+                try:
+                    with transaction.atomic(using=using):
+                        Generation.objects.using(using).create(namespace=namespace, object_pk=str(pk),
+                                                               generation=time.time_ns())
+                except IntegrityError:
+                    qs.update(generation=F('generation') + 1)
+            return qs.values_list('generation', flat=True).get()
@@ -0,0 +1,7 @@
+from django.apps import AppConfig
+
+
+class InvalidationConfig(AppConfig):
+    name = 'hierarkey.invalidation'
+    label = 'hierarkey_invalidation'
+    default_auto_field = 'django.db.models.AutoField'
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Generation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('namespace', models.CharField(max_length=190)),
+                ('object_pk', models.CharField(max_length=190)),
+                ('generation', models.BigIntegerField()),
+            ],
+            options={
+                'unique_together': {('namespace', 'object_pk')},
+            },
+        ),
+    ]
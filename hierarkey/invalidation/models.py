@@ -0,0 +1,10 @@
+from django.db import models
+
+
+class Generation(models.Model):
+    namespace = models.CharField(max_length=190)
+    object_pk = models.CharField(max_length=190)
+    generation = models.BigIntegerField()
+
+    class Meta:
+        unique_together = (('namespace', 'object_pk'),)
@@ -0,0 +1,112 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router, transaction
+from django.db.models import Q
+from functools import reduce
+from itertools import groupby
+from operator import or_
+
+from hierarkey.models import get_store_models
+from hierarkey.proxy import HierarkeyProxy, shared_storage
+
+DELETE_CHUNK_SIZE = 100
+
+
+class Command(BaseCommand):
+    help = 'Deletes stored values that are identical to the value the object would inherit from its parents or ' \
+           'the hardcoded defaults anyway.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--namespace', action='append', dest='namespaces', metavar='NAMESPACE',
+                            help='Only compact the level with this cache namespace. Can be given multiple times.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of objects processed at once.')
+        parser.add_argument('--keep-defaults', action='store_true',
+                            help='Keep values that are only identical to the hardcoded default.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many values would be deleted.')
+
+    def handle(self, *args, namespaces=None, batch_size=500, keep_defaults=False, dry_run=False, **options):
+        try:
+            stores = get_store_models(namespaces)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        total = 0
+        with shared_storage():
+            for store_model in stores:
+                total += self._compact(store_model, batch_size, keep_defaults, dry_run)
+        self.stdout.write('{} {} values in total.'.format('Would delete' if dry_run else 'Deleted', total))
+
+    def _batches(self, store_model, batch_size):
+        store = store_model._hierarkey_store
+        if store_model._hierarkey_is_global:
+            rows = list(store_model.objects.values_list('pk', 'key', 'value'))
+            yield [(store.model(), rows)]
+            return
+
+        last = None
+        while True:
+            ids = store_model.objects.order_by('object_id').values_list('object_id', flat=True).distinct()
+            if last is not None:
+                ids = ids.filter(object_id__gt=last)
+            ids = list(ids[:batch_size])
+            if not ids:
+                return
+            last = ids[-1]
+
+            objects = store.model.objects.all()
+            if store.parent_field:
+                objects = objects.select_related(store.parent_field)
+            objects = objects.in_bulk(ids)
+            rows = store_model.objects.filter(object_id__in=ids).order_by('object_id').values_list(
+                'object_id', 'pk', 'key', 'value'
+            )
+            yield [
+                (objects[object_id], [row[1:] for row in object_rows])
+                for object_id, object_rows in groupby(rows, key=lambda row: row[0])
+            ]
+
+    def _compact(self, store_model, batch_size, keep_defaults, dry_run) -> int:
+        store = store_model._hierarkey_store
+        h = store.hierarkey
+        checked = redundant = 0
+
+        for batch in self._batches(store_model, batch_size):
+            delete = []
+            changed = []
+            for obj, rows in batch:
+                proxy = getattr(obj, h.attribute_name)
+                parent = proxy._parent_proxy
+                found = False
+                for pk, key, value in rows:
+                    checked += 1
+                    inherited = parent._resolve(key) if parent is not None else None
+                    if inherited is None and not keep_defaults and key in h.defaults \
+                            and h.defaults[key].value is not None:
+                        inherited = h._serialize(h.defaults[key].value)
+                    if inherited is not None and inherited == value:
+                        delete.append((pk, value))
+                        found = True
+                if found:
+                    changed.append(proxy)
+
+            if dry_run or not delete:
+                redundant += len(delete)
+                continue
+            # Only rows still holding the compared value are deleted, so values changed in the meantime are kept.
+            # The conditions are chunked to stay below the expression depth limits of database backends.
+            deleted = 0
+            with transaction.atomic(using=router.db_for_write(store_model)):
+                for i in range(0, len(delete), DELETE_CHUNK_SIZE):
+                    condition = reduce(or_, (Q(pk=pk, value=value) for pk, value in delete[i:i + DELETE_CHUNK_SIZE]))
+                    deleted += store_model.objects.filter(condition).delete()[0]
+            redundant += deleted
+            if deleted:
+                HierarkeyProxy._pin_many(changed)
+                for proxy in changed:
+                    proxy.flush()
+
+        self.stdout.write('{}: {} {} of {} values.'.format(
+            store.cache_namespace, 'would delete' if dry_run else 'deleted', redundant, checked
+        ))
+        return redundant
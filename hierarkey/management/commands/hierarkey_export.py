@@ -0,0 +1,46 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+
+from hierarkey.models import get_store_models
+
+
+class Command(BaseCommand):
+    help = 'Exports all stored values as JSON Lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--namespace', action='append', dest='namespaces', metavar='NAMESPACE',
+                            help='Only export the level with this cache namespace. Can be given multiple times.')
+        parser.add_argument('--output', '-o', default='-',
+                            help='File to write to. Defaults to standard output.')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Number of rows fetched from the database at once.')
+
+    def handle(self, *args, namespaces=None, output='-', chunk_size=2000, **options):
+        try:
+            stores = get_store_models(namespaces)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        f = self.stdout if output == '-' else open(output, 'w', encoding='utf-8')
+        try:
+            for store_model in stores:
+                count = 0
+                for line in self._lines(store_model, chunk_size):
+                    f.write(line)
+                    count += 1
+                self.stderr.write('{}: exported {} values.'.format(store_model._hierarkey_store.cache_namespace, count))
+        finally:
+            if f is not self.stdout:
+                f.close()
+
+    def _lines(self, store_model, chunk_size):
+        namespace = store_model._hierarkey_store.cache_namespace
+        if store_model._hierarkey_is_global:
+            rows = ((None, key, value) for key, value in
+                    store_model.objects.order_by('key').values_list('key', 'value').iterator(chunk_size=chunk_size))
+        else:
+            rows = store_model.objects.order_by('object_id', 'key').values_list(
+                'object_id', 'key', 'value'
+            ).iterator(chunk_size=chunk_size)
+        for pk, key, value in rows:
+            yield json.dumps({'namespace': namespace, 'object': pk, 'key': key, 'value': value}, default=str) + '\n'
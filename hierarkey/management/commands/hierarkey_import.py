@@ -0,0 +1,96 @@
+import json
+import sys
+from collections import defaultdict
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from hierarkey.models import get_store_models
+from hierarkey.proxy import HierarkeyProxy
+
+
+class Command(BaseCommand):
+    help = 'Imports stored values from JSON Lines as written by hierarkey_export. Existing values for the same ' \
+           'object and key are overwritten.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to read from or "-" for standard input.')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of values written to the database at once.')
+
+    def handle(self, *args, path='-', chunk_size=500, **options):
+        self.stores = {s._hierarkey_store.cache_namespace: s for s in get_store_models()}
+        self.chunk_size = chunk_size
+        self.imported = defaultdict(int)
+        self.skipped = defaultdict(int)
+        self.touched = defaultdict(set)
+        pending = defaultdict(dict)
+
+        f = sys.stdin if path == '-' else open(path, encoding='utf-8')
+        try:
+            for lineno, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                    namespace, pk, key, value = row['namespace'], row['object'], row['key'], row['value']
+                except (ValueError, KeyError, TypeError):
+                    raise CommandError('Line {} is not a valid value.'.format(lineno))
+                if namespace not in self.stores:
+                    raise CommandError('Line {} refers to the unknown namespace "{}".'.format(lineno, namespace))
+                if value is None:
+                    raise CommandError('Line {} does not contain a value.'.format(lineno))
+
+                store_model = self.stores[namespace]
+                if not store_model._hierarkey_is_global:
+                    try:
+                        pk = store_model._hierarkey_store.model._meta.pk.to_python(pk)
+                    except ValidationError:
+                        pk = None
+                    if pk is None:
+                        raise CommandError('Line {} does not refer to a valid object.'.format(lineno))
+                pending[store_model][pk, key] = value
+                if len(pending[store_model]) >= chunk_size:
+                    self._write(store_model, pending.pop(store_model))
+            for store_model, values in pending.items():
+                self._write(store_model, values)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+            # Also invalidate if the import fails half-way, since the values written until then are committed
+            for store_model, pks in self.touched.items():
+                self._invalidate(store_model, pks)
+
+        for namespace, store_model in self.stores.items():
+            if store_model in self.imported or store_model in self.skipped:
+                self.stdout.write('{}: imported {} values for {} objects, skipped {} values of missing objects.'.format(
+                    namespace, self.imported[store_model], len(self.touched[store_model]), self.skipped[store_model]
+                ))
+
+    def _write(self, store_model, values: dict) -> None:
+        store = store_model._hierarkey_store
+        if store_model._hierarkey_is_global:
+            objs = [store_model(key=key, value=value) for (pk, key), value in values.items()]
+            unique_fields = ['key']
+            self.touched[store_model].add(store.model.pk)
+        else:
+            existing = set(store.model.objects.filter(
+                pk__in={pk for pk, key in values}
+            ).values_list('pk', flat=True))
+            objs = []
+            for (pk, key), value in values.items():
+                if pk in existing:
+                    objs.append(store_model(object_id=pk, key=key, value=value))
+                    self.touched[store_model].add(pk)
+                else:
+                    self.skipped[store_model] += 1
+            unique_fields = ['object', 'key']
+
+        store_model.objects.bulk_create(objs, batch_size=self.chunk_size, update_conflicts=True,
+                                        unique_fields=unique_fields, update_fields=['value'])
+        self.imported[store_model] += len(objs)
+
+    def _invalidate(self, store_model, pks) -> None:
+        store = store_model._hierarkey_store
+        objs = [store.model() if store_model._hierarkey_is_global else store.model(pk=pk) for pk in pks]
+        for i in range(0, len(objs), self.chunk_size):
+            HierarkeyProxy._flush_many(store_model, objs[i:i + self.chunk_size])
@@ -0,0 +1,107 @@
+import time
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from itertools import groupby
+
+from hierarkey.models import get_store_models
+from hierarkey.proxy import HierarkeyProxy
+
+
+class Command(BaseCommand):
+    help = 'Writes the stored values of all objects to the cache, so that the first requests after a deployment ' \
+           'or a cache flush do not need to load them from the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--namespace', action='append', dest='namespaces', metavar='NAMESPACE',
+                            help='Only warm the level with this cache namespace. Can be given multiple times.')
+        parser.add_argument('--min-pk', help='Only warm objects with a primary key of at least this value.')
+        parser.add_argument('--max-pk', help='Only warm objects with a primary key of at most this value.')
+        parser.add_argument('--filter', action='append', dest='filters', default=[], metavar='LOOKUP=VALUE',
+                            help='Only warm objects matching this lookup on their model, e.g. '
+                                 'last_login__gte=2024-01-01. Can be given multiple times.')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of objects written to the cache at once.')
+
+    def handle(self, *args, namespaces=None, min_pk=None, max_pk=None, filters=(), chunk_size=500, **options):
+        lookups = {}
+        for f in filters:
+            lookup, sep, value = f.partition('=')
+            if not sep:
+                raise CommandError('Filters need to be given as LOOKUP=VALUE, got "{}".'.format(f))
+            lookups['object__' + lookup] = value
+        if min_pk is not None:
+            lookups['object_id__gte'] = min_pk
+        if max_pk is not None:
+            lookups['object_id__lte'] = max_pk
+
+        try:
+            stores = get_store_models(namespaces)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        total_objects = 0
+        start = time.monotonic()
+        for store_model in stores:
+            if store_model._hierarkey_is_global and lookups:
+                continue
+            total_objects += self._warm(store_model, lookups, chunk_size)
+
+        duration = time.monotonic() - start
+        self.stdout.write('Warmed {} objects in {:.1f}s ({:.0f} objects/s).'.format(
+            total_objects, duration, total_objects / duration if duration else 0
+        ))
+
+    def _rows(self, store_model, lookups, chunk_size):
+        store = store_model._hierarkey_store
+        qs = store_model.objects.all()
+        if store.hierarkey.read_using:
+            qs = qs.using(store.hierarkey.read_using)
+        if store_model._hierarkey_is_global:
+            pk = store.model.pk
+            return ((pk, key, value) for key, value in qs.values_list('key', 'value').iterator(chunk_size=chunk_size))
+        return qs.filter(**lookups).order_by('object_id', 'key').values_list(
+            'object_id', 'key', 'value'
+        ).iterator(chunk_size=chunk_size)
+
+    def _warm(self, store_model, lookups, chunk_size) -> int:
+        store = store_model._hierarkey_store
+        backend = caches[store.cache.alias]
+        objects = values = written = skipped = 0
+        chunk = []
+        start = time.monotonic()
+
+        def write(chunk):
+            nonlocal written, skipped
+            if store.hierarkey.read_using:
+                # Objects changed within the last ``replica_lag`` seconds might not be up to date on the replica yet
+                markers = backend.get_many([proxy._written_key for proxy, data in chunk])
+                skipped += sum(1 for proxy, data in chunk if proxy._written_key in markers)
+                chunk = [(proxy, data) for proxy, data in chunk if proxy._written_key not in markers]
+            entries = {}
+            for proxy, data in chunk:
+                entries.update(proxy._cache_entries(data))
+            if entries:
+                backend.set_many(entries, timeout=store.cache.timeout)
+                written += len(entries)
+
+        for pk, rows in groupby(self._rows(store_model, lookups, chunk_size), key=lambda row: row[0]):
+            data = {key: value for _, key, value in rows}
+            obj = store.model() if store_model._hierarkey_is_global else store.model(pk=pk)
+            proxy = HierarkeyProxy._create(obj, hierarkey=store.hierarkey, cache_namespace=store.cache_namespace,
+                                           type=store_model, cache=store.cache)
+            chunk.append((proxy, data))
+            objects += 1
+            values += len(data)
+            if len(chunk) == chunk_size:
+                write(chunk)
+                chunk = []
+        if chunk:
+            write(chunk)
+
+        duration = time.monotonic() - start
+        self.stdout.write('{}: {} objects, {} values, {} cache entries in {:.1f}s ({:.0f} objects/s)'.format(
+            store.cache_namespace, objects, values, written, duration, objects / duration if duration else 0
+        ))
+        if skipped:
+            self.stdout.write('{}: skipped {} recently changed objects.'.format(store.cache_namespace, skipped))
+        return objects
@@ -0,0 +1,15 @@
+from hierarkey.proxy import shared_storage
+
+
+class SharedStorageMiddleware:
+    """
+    Shares storage objects between all model instances representing the same database row for the duration of
+    a request, so that the values of every object are loaded at most once per request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with shared_storage():
+            return self.get_response(request)
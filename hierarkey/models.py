@@ -1,9 +1,21 @@
-from typing import Any, Callable, Optional
+from typing import Any, Callable, Iterable, List, Optional, Set
 
+import dateutil.parser
+import decimal
+import json
 import sys
 from collections import namedtuple
+from datetime import date, datetime, time
+from django.apps import apps
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
 from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.storage import default_storage
 from django.db import models
+from itertools import islice
+
+from hierarkey import tracing
+from hierarkey.cache import bump_namespace_version
 
 
 class BaseHierarkeyStoreModel(models.Model):
@@ -21,8 +33,33 @@ class BaseHierarkeyStoreModel(models.Model):
         abstract = True
 
 
-HierarkeyDefault = namedtuple('HierarkeyDefault', ['value', 'type'])
+HierarkeyDefault = namedtuple('HierarkeyDefault', ['value', 'type', 'group', 'write_behind'], defaults=(None, False))
 HierarkeyType = namedtuple('HierarkeyType', ['type', 'serialize', 'unserialize'])
+HierarkeyCache = namedtuple('HierarkeyCache', ['alias', 'timeout', 'prefix', 'codec', 'shards', 'large_value_threshold'],
+                            defaults=(None, None))
+HierarkeyStore = namedtuple('HierarkeyStore', ['hierarkey', 'model', 'cache_namespace', 'cache', 'parent_field'])
+
+# Defaults of these types are only unserialized once. Defaults of the mutable ones are validated right away as
+# well, but unserialized again whenever they are read, which is cheaper than copying them.
+_PRECOMPILED_TYPES = (str, int, float, bool, decimal.Decimal, datetime, date, time)
+_VALIDATED_TYPES = _PRECOMPILED_TYPES + (dict, list)
+
+
+def get_store_models(namespaces: Optional[Iterable[str]] = None) -> List[type]:
+    """
+    Returns all store models created by :py:meth:`Hierarkey.add` and :py:meth:`Hierarkey.set_global` within the
+    installed apps. Every store model has a ``_hierarkey_store`` attribute describing the level it belongs to.
+
+    :param namespaces: Optional. Only return the store models of the levels with these cache namespaces. Raises
+                       ``ValueError`` if any of them does not exist.
+    """
+    stores = [m for m in apps.get_models() if issubclass(m, BaseHierarkeyStoreModel) and hasattr(m, '_hierarkey_store')]
+    if namespaces:
+        unknown = set(namespaces) - {s._hierarkey_store.cache_namespace for s in stores}
+        if unknown:
+            raise ValueError('Unknown namespaces: {}'.format(', '.join(sorted(unknown))))
+        stores = [s for s in stores if s._hierarkey_store.cache_namespace in namespaces]
+    return stores
 
 
 class Hierarkey:
@@ -32,13 +69,44 @@ class Hierarkey:
 
     :param attribute_name: The name for the attribute on the model instances that will allow access to the
                            storage, e.g. ``settings``.
+    :param read_using: Optional. The alias of a database (e.g. a read replica) that should be used to load
+                       values when they are not found in the cache. After a value has been written through
+                       a storage object, that object will read from the primary database from then on.
+    :param cache_alias: Optional. The alias of the Django cache backend used to cache values, defaults to
+                        ``default``.
+    :param cache_timeout: Optional. The number of seconds values are kept in the cache, defaults to 30 minutes.
+                          Set to ``None`` to cache values for ``cache_max_timeout`` seconds.
+    :param cache_max_timeout: Optional. The maximum number of seconds any cache entry is kept, defaults to one
+                              day. Cache entries that have been replaced by ``flush()`` or, with a generation
+                              tracker, by a change are never deleted, so they need to expire eventually. Set to
+                              ``None`` to allow entries to be cached forever.
+    :param cache_prefix: Optional. A prefix for all cache keys, defaults to ``hierarkey``.
+    :param cache_codec: Optional. An object used to encode values before they are put into the cache, e.g. a
+                        :py:class:`hierarkey.cache.CompactCodec`. By default, a plain dictionary is cached.
+    :param invalidation: Optional. A :py:class:`hierarkey.invalidation.GenerationTracker` that allows storage
+                         objects to notice changes made by other processes.
+    :param replica_lag: Optional. If ``read_using`` is set, values of an object are loaded from the primary
+                        database in all processes for this number of seconds after they have been written,
+                        defaults to 5.
     """
 
-    def __init__(self, attribute_name):
+    def __init__(self, attribute_name, read_using: str = None, cache_alias: str = 'default',
+                 cache_timeout: Optional[int] = 1800, cache_prefix: str = 'hierarkey', cache_codec=None,
+                 invalidation=None, replica_lag: int = 5, cache_max_timeout: Optional[int] = 86400):
         self.attribute_name = attribute_name
+        self.read_using = read_using
+        self.replica_lag = replica_lag
+        self.cache_alias = cache_alias
+        self.cache_timeout = cache_timeout
+        self.cache_max_timeout = cache_max_timeout
+        self.cache_prefix = cache_prefix
+        self.cache_codec = cache_codec
+        self.invalidation = invalidation
         self.global_class = None
         self.defaults = {}
         self.types = []
+        self._default_values = {}
+        self._proxy_class = None
 
     def _create_attrs(self, base_model: type, unique_together_) -> dict:
         class Meta:
@@ -53,15 +121,209 @@ class Hierarkey:
     def _create_model(self, model_name: str, attrs: dict) -> type:
         return models.base.ModelBase(model_name, (BaseHierarkeyStoreModel,), attrs)
 
-    def add_default(self, key: str, value: Optional[str], default_type: type = str) -> None:
+    def _cache_config(self, alias: Optional[str], timeout: Optional[int], prefix: Optional[str], codec,
+                      shards: Optional[int] = None, large_value_threshold: Optional[int] = None) -> HierarkeyCache:
+        if large_value_threshold and not shards:
+            raise ImproperlyConfigured('cache_large_value_threshold can only be used together with cache_shards.')
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.cache_timeout
+        if self.cache_max_timeout is not None and (timeout is None or timeout > self.cache_max_timeout):
+            timeout = self.cache_max_timeout
+        return HierarkeyCache(
+            alias=alias or self.cache_alias,
+            timeout=timeout,
+            prefix=prefix or self.cache_prefix,
+            codec=codec or self.cache_codec,
+            shards=shards,
+            large_value_threshold=large_value_threshold,
+        )
+
+    def add_default(self, key: str, value: Optional[str], default_type: type = str, group: str = None,
+                    write_behind: bool = False) -> None:
         """
         Adds a default value and a default type for a key.
 
         :param key: Key
         :param value: *Serialized* default value, i.e. a string or ``None``.
         :param default_type: The type to deserialize values for this key to, defaults to ``str``.
+        :param group: Optional. The name of a key group this key belongs to. You can obtain storage objects
+                      that only load the keys of some groups using ``only()``.
+        :param write_behind: Optional. If ``True``, values written for this key are buffered within the process
+                             and written to the database in bulk periodically instead of immediately. This is
+                             meant for keys that are written very often and may lose their latest changes if a
+                             process crashes, e.g. timestamps or usage counters. See :ref:`write-behind`.
+        """
+        default = HierarkeyDefault(value, default_type, group, write_behind)
+        # Only built-in types are checked right away, since this usually runs at import time, before apps are
+        # ready and possibly before add_type() has been called for custom types
+        if value is not None and default_type in _VALIDATED_TYPES:
+            try:
+                unserialized = self._unserialize(value, default_type)
+            except (ValueError, TypeError, ArithmeticError) as e:
+                raise ImproperlyConfigured('The default value {!r} of "{}" cannot be read as {}: {}'.format(
+                    value, key, default_type.__name__, e
+                ))
+            if default_type in _PRECOMPILED_TYPES:
+                self._default_values[key] = (default, unserialized)
+        self.defaults[key] = default
+        self._proxy_class = None
+
+    def _default_value(self, key: str, as_type: type = None, binary_file: bool = False) -> Any:
+        """
+        Returns the unserialized default value of ``key``. Defaults of immutable built-in types are only unserialized
+        once per declaration.
+        """
+        default = self.defaults[key]
+        if as_type is None:
+            as_type = default.type
+        if as_type is not default.type or default.value is None or as_type not in _PRECOMPILED_TYPES:
+            return self._unserialize(default.value, as_type, binary_file=binary_file)
+        compiled = self._default_values.get(key)
+        if compiled is None or compiled[0] is not default:
+            # The defaults have been changed without add_default()
+            compiled = self._default_values[key] = (default, self._unserialize(default.value, as_type))
+        return compiled[1]
+
+    def _get_proxy_class(self) -> type:
+        """
+        Returns the class of the storage objects of this hierarchy, which has an attribute for every declared key.
+        It is created again after further keys have been declared.
+        """
+        if self._proxy_class is None:
+            from .proxy import HierarkeyProxy
+
+            self._proxy_class = HierarkeyProxy._with_accessors(
+                '{}Proxy'.format(self.attribute_name.title()), dict(self.defaults)
+            )
+        return self._proxy_class
+
+    def get_groups(self) -> Set[str]:
         """
-        self.defaults[key] = HierarkeyDefault(value, default_type)
+        Returns the names of all key groups declared using add_default.
+        """
+        return {d.group for d in self.defaults.values() if d.group is not None}
+
+    def get_group_keys(self, *groups: str) -> List[str]:
+        """
+        Returns all keys that are declared to belong to any of the given key groups.
+
+        :param groups: Names of key groups
+        """
+        unknown = set(groups) - self.get_groups()
+        if unknown:
+            raise ValueError('Unknown key group(s): {}'.format(', '.join(sorted(unknown))))
+        return [key for key, d in self.defaults.items() if d.group in groups]
+
+    def _store_model(self, model: type) -> type:
+        for store_model in get_store_models():
+            store = store_model._hierarkey_store
+            if store.hierarkey is self and issubclass(model, store.model):
+                return store_model
+        raise ValueError('No storage of this Hierarkey is attached to {}.'.format(model.__name__))
+
+    def flush(self, model: type = None) -> None:
+        """
+        Discards the cache entries of all objects of ``model``, or of all levels of this ``Hierarkey`` if no model
+        is given, e.g. after you changed a default or modified stored values with a data migration. This takes
+        the same time regardless of the number of objects, since it only changes a version number that is part of
+        all cache keys of the level. Other processes notice the change within
+        ``hierarkey.cache.VERSION_CHECK_INTERVAL`` seconds. Storage objects that already loaded their values keep
+        them.
+
+        :param model: Optional. The model (or global settings class) to flush the cache for.
+        """
+        if model is not None:
+            store_models = [self._store_model(model)]
+        else:
+            store_models = [s for s in get_store_models() if s._hierarkey_store.hierarkey is self]
+        for store_model in store_models:
+            store = store_model._hierarkey_store
+            bump_namespace_version(store.cache.alias, store.cache.prefix, store.cache_namespace)
+
+    def clone(self, source: models.Model, targets: Iterable[models.Model], only_missing: bool = False,
+              batch_size: int = 1000) -> None:
+        """
+        Copies all values stored for ``source`` to all ``targets``, which need to be instances of the same model.
+        Values are copied as they are stored, without unserializing and serializing them again. Values the source
+        only inherits from its parents or defaults are not copied.
+
+        :param source: The object to copy values from.
+        :param targets: An iterable of objects to copy values to.
+        :param only_missing: Optional. If ``True``, values that are already set on a target are kept. Otherwise,
+                             they are overwritten.
+        :param batch_size: Optional. The maximum number of values written to the database with a single query.
+        """
+        from .proxy import HierarkeyProxy
+
+        store_model = self._store_model(type(source))
+        if store_model._hierarkey_is_global:
+            raise ValueError('Global settings cannot be cloned.')
+        rows = list(store_model.objects.filter(object=source).values_list('key', 'value'))
+        if not rows:
+            return
+        if only_missing:
+            conflicts = {'ignore_conflicts': True}
+        else:
+            conflicts = {'update_conflicts': True, 'unique_fields': ['object', 'key'], 'update_fields': ['value']}
+
+        targets = iter(targets)
+        per_query = max(1, batch_size // len(rows))
+        while True:
+            chunk = list(islice(targets, per_query))
+            if not chunk:
+                break
+            if not all(isinstance(target, type(source)) for target in chunk):
+                raise ValueError('Values can only be cloned between objects of the same model.')
+            store_model.objects.bulk_create(
+                [store_model(object_id=target.pk, key=key, value=value) for target in chunk for key, value in rows],
+                batch_size=batch_size, **conflicts
+            )
+            HierarkeyProxy._flush_many(store_model, chunk)
+
+    def set_for_queryset(self, queryset: models.QuerySet, key: str, value: Any, batch_size: int = 1000) -> None:
+        """
+        Stores a setting for every object in ``queryset``. The value is only serialized once and written with one
+        query per ``batch_size`` objects. The cache entries of each batch are discarded at once.
+
+        :param queryset: The objects to change.
+        :param key: The key of the setting.
+        :param value: The new value.
+        :param batch_size: Optional. The number of objects changed with a single query.
+        """
+        from .proxy import HierarkeyProxy
+
+        store_model = self._store_model(queryset.model)
+        serialized_value = self._serialize(value)
+        pks = queryset.order_by().values_list('pk', flat=True).iterator(chunk_size=batch_size)
+        while True:
+            chunk = list(islice(pks, batch_size))
+            if not chunk:
+                break
+            store_model.objects.bulk_create(
+                [store_model(object_id=pk, key=key, value=serialized_value) for pk in chunk],
+                update_conflicts=True, unique_fields=['object', 'key'], update_fields=['value'],
+            )
+            HierarkeyProxy._flush_many(store_model, [queryset.model(pk=pk) for pk in chunk])
+
+    def delete_for_queryset(self, queryset: models.QuerySet, key: str, batch_size: int = 1000) -> None:
+        """
+        Deletes a setting from every object in ``queryset`` with one query per ``batch_size`` objects that have a
+        value for this key. The cache entries of each batch are discarded at once.
+
+        :param queryset: The objects to change.
+        :param key: The key of the setting.
+        :param batch_size: Optional. The number of objects changed with a single query.
+        """
+        from .proxy import HierarkeyProxy
+
+        store_model = self._store_model(queryset.model)
+        rows = store_model.objects.filter(object__in=queryset.values('pk'), key=key)
+        while True:
+            chunk = list(rows.order_by('pk').values_list('pk', 'object_id')[:batch_size])
+            if not chunk:
+                break
+            store_model.objects.filter(pk__in=[pk for pk, object_id in chunk]).delete()
+            HierarkeyProxy._flush_many(store_model, [queryset.model(pk=object_id) for pk, object_id in chunk])
 
     def get_declared_type(self, key: str) -> type:
         """
@@ -81,13 +343,83 @@ class Hierarkey:
         """
         self.types.append(HierarkeyType(type=type, serialize=serialize, unserialize=unserialize))
 
-    def set_global(self, cache_namespace: str = None) -> type:
+    def _unserialize(self, value: str, as_type: type, binary_file=False) -> Any:
+        if as_type is None and value is not None and value.startswith('file://'):
+            as_type = File
+
+        if as_type is not None and isinstance(value, as_type):
+            return value
+        elif value is None:
+            return None
+        elif as_type == int or as_type == float or as_type == decimal.Decimal:
+            return as_type(value)
+        elif as_type == dict or as_type == list:
+            return json.loads(value)
+        elif as_type == bool or value in ('True', 'False'):
+            return value == 'True'
+        elif as_type == File:
+            try:
+                with tracing.span('hierarkey.file_open', path=value[7:]):
+                    fi = default_storage.open(value[7:], 'rb' if binary_file else 'r')
+                    fi.url = default_storage.url(value[7:])
+                return fi
+            except OSError:
+                return False
+        elif as_type == datetime:
+            return dateutil.parser.parse(value)
+        elif as_type == date:
+            return dateutil.parser.parse(value).date()
+        elif as_type == time:
+            return dateutil.parser.parse(value).time()
+        elif as_type is not None:
+            for t in self.types:
+                if issubclass(as_type, t.type):
+                    return t.unserialize(value)
+
+        if as_type is not None and issubclass(as_type, models.Model):
+            return as_type.objects.get(pk=value)
+
+        return value
+
+    def _serialize(self, value: Any) -> str:
+        if isinstance(value, str):
+            return value
+        elif isinstance(value, int) or isinstance(value, float) \
+                or isinstance(value, bool) or isinstance(value, decimal.Decimal):
+            return str(value)
+        elif isinstance(value, list) or isinstance(value, dict):
+            return json.dumps(value)
+        elif isinstance(value, datetime) or isinstance(value, date) or isinstance(value, time):
+            return value.isoformat()
+        elif isinstance(value, models.Model):
+            return value.pk
+        elif isinstance(value, File):
+            return 'file://' + value.name
+        else:
+            for t in self.types:
+                if isinstance(value, t.type):
+                    return t.serialize(value)
+
+        raise TypeError('Unable to serialize %s into a setting.' % str(type(value)))
+
+    def set_global(self, cache_namespace: str = None, cache_alias: str = None, cache_timeout: Optional[int] = DEFAULT_TIMEOUT,
+                   cache_prefix: str = None, cache_codec=None, cache_shards: int = None,
+                   cache_large_value_threshold: int = None) -> type:
         """
         Decorator. Attaches the global key-value store of this hierarchy to an object.
 
         :param cache_namespace: Optional. A custom namespace used for caching. By default this is
                                 constructed from the name of the class this is applied to and
                                 the ``attribute_name`` of this ``Hierarkey`` object.
+        :param cache_alias: Optional. Overrides the ``cache_alias`` of this ``Hierarkey`` object for this level.
+        :param cache_timeout: Optional. Overrides the ``cache_timeout`` of this ``Hierarkey`` object for this level.
+        :param cache_prefix: Optional. Overrides the ``cache_prefix`` of this ``Hierarkey`` object for this level.
+        :param cache_codec: Optional. Overrides the ``cache_codec`` of this ``Hierarkey`` object for this level.
+        :param cache_shards: Optional. Spreads the cached values of every object across this number of cache
+                             entries that are only fetched when a key within them is accessed. Useful for
+                             levels with a large number of keys.
+        :param cache_large_value_threshold: Optional. If sharding is enabled, values with at least this number of
+                                            characters are cached separately and only fetched when they are read.
         """
 
         if isinstance(cache_namespace, type):
@@ -103,6 +435,8 @@ class Hierarkey:
                                            'GlobalSettingsBase.')
 
             _cache_namespace = cache_namespace or ('%s_%s' % (wrapped_class.__name__, self.attribute_name))
+            _cache = self._cache_config(cache_alias, cache_timeout, cache_prefix, cache_codec, cache_shards,
+                                        cache_large_value_threshold)
 
             model_name = '%s_%sStore' % (wrapped_class.__name__, self.attribute_name.title())
             if getattr(sys.modules[wrapped_class.__module__], model_name, None):
@@ -110,6 +444,8 @@ class Hierarkey:
                 return wrapped_class
 
             attrs = self._create_attrs(wrapped_class, (("key",),))
+            attrs['_hierarkey_is_global'] = True
+            attrs['_hierarkey_store'] = HierarkeyStore(self, wrapped_class, _cache_namespace, _cache, None)
             kv_model = self._create_model(model_name, attrs)
 
             def init(self, *args, object=None, **kwargs):
@@ -126,7 +462,7 @@ class Hierarkey:
                 cached = getattr(iself, attrname, None)
                 if not cached:
                     cached = HierarkeyProxy._new(iself, type=kv_model, hierarkey=hierarkey,
-                                                 cache_namespace=_cache_namespace)
+                                                 cache_namespace=_cache_namespace, cache=_cache)
                     setattr(iself, attrname, cached)
                 return cached
 
@@ -138,7 +474,9 @@ class Hierarkey:
 
         return wrapper
 
-    def add(self, cache_namespace: str = None, parent_field: str = None) -> type:
+    def add(self, cache_namespace: str = None, parent_field: str = None, cache_alias: str = None,
+            cache_timeout: Optional[int] = DEFAULT_TIMEOUT, cache_prefix: str = None, cache_codec=None,
+            cache_shards: int = None, cache_large_value_threshold: int = None) -> type:
         """
         Decorator. Attaches a global key-value store to a Django model.
 
@@ -147,6 +485,15 @@ class Hierarkey:
                                 the ``attribute_name`` of this ``Hierarkey`` object.
         :param parent_field: Optional. The name of a field of this model that refers to the parent
                              in the hierarchy. This must be a ``ForeignKey`` field.
+        :param cache_alias: Optional. Overrides the ``cache_alias`` of this ``Hierarkey`` object for this level.
+        :param cache_timeout: Optional. Overrides the ``cache_timeout`` of this ``Hierarkey`` object for this level.
+        :param cache_prefix: Optional. Overrides the ``cache_prefix`` of this ``Hierarkey`` object for this level.
+        :param cache_codec: Optional. Overrides the ``cache_codec`` of this ``Hierarkey`` object for this level.
+        :param cache_shards: Optional. Spreads the cached values of every object across this number of cache
+                             entries that are only fetched when a key within them is accessed. Useful for
+                             levels with a large number of keys.
+        :param cache_large_value_threshold: Optional. If sharding is enabled, values with at least this number of
+                                            characters are cached separately and only fetched when they are read.
         """
         if isinstance(cache_namespace, type):
             raise ImproperlyConfigured('Incorrect decorator usage, you need to use .add() instead of .add')
@@ -156,8 +503,12 @@ class Hierarkey:
                 raise ImproperlyConfigured('Hierarkey.add() can only be invoked on a Django model')
 
             _cache_namespace = cache_namespace or ('%s_%s' % (model.__name__, self.attribute_name))
+            _cache = self._cache_config(cache_alias, cache_timeout, cache_prefix, cache_codec, cache_shards,
+                                        cache_large_value_threshold)
 
             attrs = self._create_attrs(model, (("object", "key"),))
+            attrs['_hierarkey_is_global'] = False
+            attrs['_hierarkey_store'] = HierarkeyStore(self, model, _cache_namespace, _cache, parent_field)
             attrs['object'] = models.ForeignKey(model, related_name='_%s_objects' % self.attribute_name,
                                                 on_delete=models.CASCADE)
             model_name = '%s_%sStore' % (model.__name__, self.attribute_name.title())
@@ -186,7 +537,8 @@ class Hierarkey:
                         type=kv_model,
                         hierarkey=hierarkey,
                         parent=parent,
-                        cache_namespace=_cache_namespace
+                        cache_namespace=_cache_namespace,
+                        cache=_cache,
                     )
                     setattr(iself, attrname, cached)
                 return cached
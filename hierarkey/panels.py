@@ -0,0 +1,116 @@
+from typing import Dict, Iterable, List
+
+from collections import Counter
+from debug_toolbar.panels import Panel
+from django.utils.html import format_html, format_html_join
+
+from hierarkey.stats import RecordingCollector, StatsEvent
+
+
+def summarize(events: Iterable[StatsEvent]) -> Dict[str, List[dict]]:
+    """
+    Turns the events recorded during a request into the tables shown by :py:class:`HierarkeyPanel`.
+    """
+    proxies = Counter()
+    fetches = Counter()
+    lookups = []
+    loads = []
+    reads = []
+    for event in events:
+        pk = str(event.context.get('pk'))
+        if event.metric == 'proxy_created':
+            proxies[event.namespace, pk] += 1
+        elif event.metric == 'fetch':
+            fetches[event.namespace, pk] += 1
+        elif event.metric in ('cache_hit', 'cache_miss'):
+            lookups.append({'namespace': event.namespace, 'cache_key': event.context['cache_key'],
+                            'hit': event.metric == 'cache_hit'})
+        elif event.metric == 'db_load' and event.kind == 'incr':
+            loads.append({'namespace': event.namespace, 'pk': pk, 'rows': 0, 'time': 0.0})
+        elif event.metric == 'db_rows' and loads:
+            loads[-1]['rows'] = event.value
+        elif event.metric == 'db_load' and loads:
+            loads[-1]['time'] = event.value * 1000
+        elif event.metric == 'read':
+            reads.append({'namespace': event.namespace, 'pk': pk, 'key': event.context['key'],
+                          'level': event.context['level']})
+
+    return {
+        'proxies': [{'namespace': ns, 'pk': pk, 'count': count} for (ns, pk), count in proxies.items()],
+        'lookups': lookups,
+        'loads': loads,
+        'reads': reads,
+        'duplicates': [{'namespace': ns, 'pk': pk, 'count': count} for (ns, pk), count in fetches.items()
+                       if count > 1],
+    }
+
+
+def _table(caption: str, headers: Iterable[str], rows: Iterable[Iterable]) -> str:
+    rows = list(rows)
+    if not rows:
+        return ''
+    return format_html(
+        '<h4>{}</h4><table><thead><tr>{}</tr></thead><tbody>{}</tbody></table>',
+        caption,
+        format_html_join('', '<th>{}</th>', ((h,) for h in headers)),
+        format_html_join('', '<tr>{}</tr>', (
+            (format_html_join('', '<td>{}</td>', ((cell,) for cell in row)),) for row in rows
+        )),
+    )
+
+
+class HierarkeyPanel(Panel):
+    """
+    A panel for `django-debug-toolbar`_ listing all storage objects created during a request, all cache entries
+    fetched, all database queries loading values and the level every value was read from. Objects whose values
+    have been fetched more than once are listed separately to help you spot N+1 patterns.
+
+    To use it, add ``'hierarkey.panels.HierarkeyPanel'`` to your ``DEBUG_TOOLBAR_PANELS`` setting.
+
+    .. _django-debug-toolbar: https://django-debug-toolbar.readthedocs.io/
+    """
+    title = 'Hierarkey'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._recorder = RecordingCollector()
+
+    @property
+    def nav_subtitle(self):
+        stats = self.get_stats()
+        if not stats:
+            return ''
+        return '{} reads, {} cache misses, {} loads'.format(
+            len(stats['reads']), sum(1 for lookup in stats['lookups'] if not lookup['hit']), len(stats['loads'])
+        )
+
+    def enable_instrumentation(self):
+        self._recorder.start()
+
+    def disable_instrumentation(self):
+        self._recorder.stop()
+
+    def generate_stats(self, request, response):
+        self.record_stats(summarize(self._recorder.events))
+
+    @property
+    def content(self):
+        stats = self.get_stats()
+        return format_html(
+            '{}{}{}{}{}',
+            _table('Fetched more than once', ('Namespace', 'Object', 'Fetches'), (
+                (d['namespace'], d['pk'], d['count']) for d in stats.get('duplicates', ())
+            )),
+            _table('Storage objects', ('Namespace', 'Object', 'Created'), (
+                (p['namespace'], p['pk'], p['count']) for p in stats.get('proxies', ())
+            )),
+            _table('Cache lookups', ('Namespace', 'Cache key', 'Result'), (
+                (lk['namespace'], lk['cache_key'], 'hit' if lk['hit'] else 'miss') for lk in stats.get('lookups', ())
+            )),
+            _table('Database loads', ('Namespace', 'Object', 'Rows', 'Time (ms)'), (
+                (ld['namespace'], ld['pk'], ld['rows'], '{:.2f}'.format(ld['time'])) for ld in stats.get('loads', ())
+            )),
+            _table('Reads', ('Namespace', 'Object', 'Key', 'Taken from'), (
+                (r['namespace'], r['pk'], r['key'], r['level'] or '–') for r in stats.get('reads', ())
+            )),
+        )
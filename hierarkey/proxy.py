@@ -1,16 +1,96 @@
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 
-import dateutil.parser
-import decimal
-import json
-from datetime import date, datetime, time
-from django.core.cache import cache
-from django.core.files import File
-from django.core.files.storage import default_storage
-from django.db.models import Model
-from functools import cached_property
+import keyword
+import sys
+import time
+import weakref
+from asgiref.local import Local
+from collections.abc import Mapping
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.signals import request_finished, request_started
+from django.db import IntegrityError, router, transaction
+from django.db.models import BigIntegerField, F, Model, TextField
+from django.db.models.functions import Cast
+from types import MappingProxyType
 
-from hierarkey.models import Hierarkey
+from hierarkey import stats, tracing, writebehind
+from hierarkey.cache import ShardedStore, namespace_version, shard_cache_keys
+from hierarkey.models import Hierarkey, HierarkeyCache
+
+_primary_pins = Local()
+
+
+def _reset_primary_pins(**kwargs):
+    _primary_pins.keys = set()
+
+
+request_started.connect(_reset_primary_pins)
+request_finished.connect(_reset_primary_pins)
+
+_registry = ContextVar('hierarkey_registry', default=None)
+
+
+@contextmanager
+def shared_storage():
+    """
+    Context manager. Within this context, all storage objects for the same object (e.g. two model instances
+    representing the same database row) are shared, so that values are only loaded once. Changes made through
+    any of the model instances are immediately visible through all of them.
+
+    You can use :py:class:`hierarkey.middleware.SharedStorageMiddleware` to apply this to every request.
+    """
+    token = _registry.set({}) if _registry.get() is None else None
+    try:
+        yield
+    finally:
+        if token is not None:
+            _registry.reset(token)
+
+
+# Marks keys deleted within a batch
+_DELETED = object()
+
+
+class KeyNotLoaded(LookupError):
+    """
+    Raised when a key is read from a storage object that has been restricted to key groups that do not include
+    this key.
+    """
+
+
+class _KeyAccessor:
+    """
+    Reads a key declared with ``add_default()`` on attribute access, with its type and default bound in advance.
+    Falls back to ``get()`` whenever the fast path would behave differently.
+    """
+    __slots__ = ('key', 'default')
+
+    def __init__(self, key: str, default):
+        self.key = key
+        self.default = default
+
+    def __get__(self, proxy: 'HierarkeyProxy', owner=None) -> Any:
+        if proxy is None:
+            return self
+        h = proxy._h
+        if proxy._keys is not None or h.invalidation is not None or stats.collectors \
+                or h.defaults.get(self.key) is not self.default:
+            return proxy.get(self.key)
+        value = proxy._resolve(self.key)
+        if value is None:
+            return None if self.default.value is None else h._default_value(self.key)
+        return h._unserialize(value, self.default.type)
+
+
+def _unpickle_proxy(obj: Model, store_model: type, parent: Optional[Model], groups: Optional[tuple]):
+    # ``obj`` might not have its fields restored yet if the storage object is unpickled as part of it
+    store = store_model._hierarkey_store
+    proxy = HierarkeyProxy._create(obj, store.hierarkey, store.cache_namespace, parent, store_model, store.cache,
+                                   count=False)
+    return proxy.only(*groups) if groups is not None else proxy
 
 
 class HierarkeyProxy:
@@ -21,19 +101,96 @@ class HierarkeyProxy:
     This class allows access to settings via attribute access, item access or using the documented methods.
     You should not instantiate this class yourself.
     """
+    __slots__ = (
+        '_obj', '_h', '_cache_namespace', '_cache_config', '_parent', '_cached_obj', '_type', '_groups', '_keys',
+        '_restricted', '_origin', '_resolved', '_dependents', '_generation', '_batch', '__weakref__',
+    )
 
     @classmethod
     def _new(cls, obj: Model, hierarkey: Hierarkey, cache_namespace: str, parent: Optional[Model] = None,
-             type: type = None):
-        o = HierarkeyProxy()
+             type: type = None, cache: HierarkeyCache = None):
+        registry = _registry.get()
+        if registry is not None and obj.pk is not None:
+            try:
+                return registry[cache_namespace, obj.pk]
+            except KeyError:
+                o = registry[cache_namespace, obj.pk] = cls._create(obj, hierarkey, cache_namespace, parent, type, cache)
+                return o
+        return cls._create(obj, hierarkey, cache_namespace, parent, type, cache)
+
+    @classmethod
+    def _create(cls, obj: Model, hierarkey: Hierarkey, cache_namespace: str, parent: Optional[Model] = None,
+                type: type = None, cache: HierarkeyCache = None, count: bool = True):
+        o = hierarkey._get_proxy_class()()
         o._obj = obj
         o._h = hierarkey
         o._cache_namespace = cache_namespace
+        o._cache_config = cache or hierarkey._cache_config(None, DEFAULT_TIMEOUT, None, None)
         o._parent = parent
         o._cached_obj = None
         o._type = type
+        o._groups = None
+        o._keys = None
+        # The following containers are only created once they are needed to keep storage objects small
+        o._restricted = None
+        o._origin = None
+        o._resolved = None
+        o._dependents = None
+        o._generation = None
+        o._batch = None
+        if count and stats.collectors:
+            stats.incr('proxy_created', cache_namespace, pk=obj.pk)
         return o
 
+    def __reduce__(self):
+        # The generated subclass cannot be pickled and loaded values would be stale once unpickled, so a storage
+        # object (e.g. as part of a pickled model instance) is restored as a plain one for the same object
+        return _unpickle_proxy, (self._obj, self._type, self._parent, self._groups)
+
+    @classmethod
+    def _with_accessors(cls, name: str, defaults: Dict[str, Any]) -> type:
+        """
+        Returns a subclass with an attribute for every declared key that does not clash with the attributes of
+        this class, so that reading these keys does not need to go through ``__getattr__``.
+        """
+        attrs = {
+            key: _KeyAccessor(key, default) for key, default in defaults.items()
+            if key.isidentifier() and not keyword.iskeyword(key) and not key.startswith('_') and not hasattr(cls, key)
+        }
+        return type(name, (cls,), {'__slots__': (), '__module__': cls.__module__, **attrs})
+
+    def only(self, *groups: str) -> 'HierarkeyProxy':
+        """
+        Returns a storage object for the same object that only loads the keys belonging to the given key groups
+        (see :py:meth:`Hierarkey.add_default() <hierarkey.models.Hierarkey.add_default>`). Reading any other key
+        from the returned object raises ``hierarkey.proxy.KeyNotLoaded``.
+
+        :param groups: Names of key groups
+        """
+        if self._origin is not None:
+            return self._origin.only(*groups)
+        groups = tuple(sorted(set(groups)))
+        if self._restricted is None:
+            self._restricted = {}
+        if groups not in self._restricted:
+            keys = self._h.get_group_keys(*groups)
+            o = HierarkeyProxy._create(self._obj, hierarkey=self._h, cache_namespace=self._cache_namespace,
+                                       parent=self._parent, type=self._type, cache=self._cache_config)
+            o._groups = groups
+            o._keys = frozenset(keys)
+            o._origin = self
+            self._restricted[groups] = o
+        return self._restricted[groups]
+
+    @property
+    def _parent_proxy(self) -> Optional['HierarkeyProxy']:
+        if not self._parent:
+            return None
+        proxy = getattr(self._parent, self._h.attribute_name)
+        if self._groups is not None:
+            proxy = proxy.only(*self._groups)
+        return proxy
+
     @property
     def _objects(self):
         """
@@ -42,96 +199,383 @@ class HierarkeyProxy:
         """
         return getattr(self._obj, '_%s_objects' % self._h.attribute_name)
 
+    @property
+    def _cache_backend(self):
+        return caches[self._cache_config.alias]
+
+    @property
+    def _cache_key(self) -> str:
+        version = namespace_version(self._cache_config.alias, self._cache_config.prefix, self._cache_namespace)
+        key = '{}_{}_{}_{}'.format(self._cache_config.prefix, self._cache_namespace, version, self._obj.pk)
+        if self._h.invalidation is not None:
+            # Entries written before the latest change are never read again, even from a cache backend that other
+            # processes cannot delete from
+            key += '_g{}'.format(self._h.invalidation.current(self._cache_namespace, self._obj.pk))
+        return key
+
+    def _group_cache_key(self, group: str) -> str:
+        return '{}_g_{}'.format(self._cache_key, group)
+
+    def _encode(self, data: Dict[str, str]) -> Any:
+        return self._cache_config.codec.encode(data) if self._cache_config.codec else data
+
+    def _decode(self, payload: Any) -> Optional[Dict[str, str]]:
+        if stats.collectors and payload is not None:
+            start = time.perf_counter()
+            data = self._decode_payload(payload)
+            stats.timing('decode', self._cache_namespace, time.perf_counter() - start, pk=self._obj.pk)
+            return data
+        return self._decode_payload(payload)
+
+    def _decode_payload(self, payload: Any) -> Optional[Dict[str, str]]:
+        if self._cache_config.codec:
+            return self._cache_config.codec.decode(payload) if payload is not None else None
+        return {sys.intern(k): v for k, v in payload.items()} if isinstance(payload, dict) else None
+
     def _cache(self) -> Dict[str, Any]:
-        if self._cached_obj is None:
-            self._cached_obj = cache.get_or_set(
-                'hierarkey_{}_{}'.format(self._cache_namespace, self._obj.pk),
-                lambda: {s.key: s.value for s in self._objects.all()},
-                timeout=1800
-            )
+        if self._cached_obj is not None:
+            return self._cached_obj
+
+        with tracing.span('hierarkey.fetch', self._cache_namespace, self._obj.pk):
+            self._cached_obj = self._fetch()
+            # Values of write-behind keys that have not been written to the database yet are not part of the
+            # cache entry either
+            for key, value in writebehind.pending(self._type, self._obj.pk).items():
+                if self._keys is None or key in self._keys:
+                    self._cached_obj[key] = value
         return self._cached_obj
 
+    def _fetch(self) -> Dict[str, Any]:
+        if self._h.invalidation is not None:
+            self._generation = self._h.invalidation.current(self._cache_namespace, self._obj.pk)
+        if stats.collectors:
+            stats.incr('fetch', self._cache_namespace, pk=self._obj.pk)
+
+        if self._groups is not None:
+            return self._load_groups()
+        elif self._cache_config.shards:
+            return ShardedStore(self._cache_backend, self._cache_key, self._cache_config, self._load,
+                                namespace=self._cache_namespace)
+
+        data = self._decode(self._cache_backend.get(self._cache_key))
+        if stats.collectors:
+            stats.incr('cache_miss' if data is None else 'cache_hit', self._cache_namespace, pk=self._obj.pk,
+                       cache_key=self._cache_key)
+        tracing.annotate(cache_hit=data is not None)
+        if data is None:
+            data = self._load()
+            self._cache_backend.set(self._cache_key, self._encode(data), timeout=self._cache_config.timeout)
+        tracing.annotate(key_count=len(data))
+        return data
+
+    def _cache_entries(self, data: Dict[str, str]) -> Dict[str, Any]:
+        """
+        Returns all cache entries this storage object would write to the cache backend for the given values,
+        including the entries of all key groups.
+        """
+        if self._cache_config.shards:
+            entries = ShardedStore(self._cache_backend, self._cache_key, self._cache_config, self._load)._entries(data)
+        else:
+            entries = {self._cache_key: self._encode(data)}
+        for group in self._h.get_groups():
+            entries[self._group_cache_key(group)] = self._encode({
+                k: data[k] for k in self._h.get_group_keys(group) if k in data
+            })
+        return entries
+
+    def _load_groups(self) -> Dict[str, str]:
+        payloads = self._cache_backend.get_many([self._group_cache_key(g) for g in self._groups])
+        data = {}
+        missing = []
+        for group in self._groups:
+            group_data = self._decode(payloads.get(self._group_cache_key(group)))
+            if stats.collectors:
+                stats.incr('cache_miss' if group_data is None else 'cache_hit', self._cache_namespace, pk=self._obj.pk,
+                           cache_key=self._group_cache_key(group))
+            if group_data is None:
+                missing.append(group)
+            else:
+                data.update(group_data)
+        tracing.annotate(cache_hit=not missing)
+
+        if missing:
+            group_keys = {group: self._h.get_group_keys(group) for group in missing}
+            loaded = self._load(keys=[k for keys in group_keys.values() for k in keys])
+            self._cache_backend.set_many({
+                self._group_cache_key(group): self._encode({k: loaded[k] for k in keys if k in loaded})
+                for group, keys in group_keys.items()
+            }, timeout=self._cache_config.timeout)
+            data.update(loaded)
+        tracing.annotate(key_count=len(data))
+        return data
+
+    def _load(self, keys: List[str] = None) -> Dict[str, str]:
+        with tracing.span('hierarkey.load', self._cache_namespace, self._obj.pk):
+            if stats.collectors:
+                start = time.perf_counter()
+                data = self._load_from_database(keys)
+                stats.incr('db_load', self._cache_namespace, pk=self._obj.pk)
+                stats.incr('db_rows', self._cache_namespace, len(data), pk=self._obj.pk)
+                stats.timing('db_load', self._cache_namespace, time.perf_counter() - start, pk=self._obj.pk)
+            else:
+                data = self._load_from_database(keys)
+            tracing.annotate(key_count=len(data))
+            return data
+
+    def _load_from_database(self, keys: List[str] = None) -> Dict[str, str]:
+        if not self._h.read_using:
+            qs = self._objects.all() if keys is None else self._objects.filter(key__in=keys)
+            return {sys.intern(s.key): s.value for s in qs}
+
+        primary = router.db_for_write(self._type)
+        if (self._cache_namespace, self._obj.pk) in getattr(_primary_pins, 'keys', ()) or self._recently_written():
+            # The values have been written during the current request or shortly before, so we must not read from
+            # a replica that might still lag behind the write.
+            return self._load_using(primary, keys)
+        data = self._load_using(self._h.read_using, keys)
+        if self._recently_written():
+            # The values have been written while we loaded them, so the replica might not have the change yet and
+            # we must not put what we loaded into the cache.
+            data = self._load_using(primary, keys)
+        return data
+
+    def _load_using(self, using: str, keys: List[str] = None) -> Dict[str, str]:
+        # values_list() prevents Django from attaching our object (which lives on a different database) to the rows
+        qs = self._objects.using(using)
+        if keys is not None:
+            qs = qs.filter(key__in=keys)
+        return {sys.intern(key): value for key, value in qs.values_list('key', 'value')}
+
+    @property
+    def _written_key(self) -> str:
+        return '{}_{}_{}_written'.format(self._cache_config.prefix, self._cache_namespace, self._obj.pk)
+
+    def _recently_written(self) -> bool:
+        return self._cache_backend.get(self._written_key) is not None
+
+    def _pin_to_primary(self):
+        self._pin_many([self])
+
+    @classmethod
+    def _pin_many(cls, proxies: List['HierarkeyProxy']) -> None:
+        """
+        Makes sure that loads of the given storage objects go to the primary database for the rest of the current
+        request in this process and for ``replica_lag`` seconds in all processes, since a replica might not have
+        the values just written yet.
+        """
+        if not proxies or not proxies[0]._h.read_using:
+            return
+        if not hasattr(_primary_pins, 'keys'):
+            _primary_pins.keys = set()
+        _primary_pins.keys.update((p._cache_namespace, p._obj.pk) for p in proxies)
+        proxies[0]._cache_backend.set_many({p._written_key: True for p in proxies}, timeout=proxies[0]._h.replica_lag)
+
     def flush(self) -> None:
         """
         Discards both the state within this object as well as the cache in Django's cache backend.
         """
-        self._cached_obj = None
+        self._discard_state()
         self._flush_external_cache()
 
+    def _sharing_state(self) -> List['HierarkeyProxy']:
+        """
+        Returns all storage objects for the same model instance, i.e. the unrestricted one and all storage objects
+        restricted to key groups obtained from it. A change made through any of them needs to be applied to all.
+        """
+        origin = self._origin or self
+        return [origin, *(origin._restricted.values() if origin._restricted else ())]
+
+    def _discard_state(self) -> None:
+        proxies = self._sharing_state()
+        for proxy in proxies:
+            proxy._cached_obj = None
+        proxies[0]._invalidate_resolved()
+
+    @classmethod
+    def _patch_many(cls, store_model: type, changes: Dict[Any, Dict[str, str]]) -> None:
+        """
+        Changes values within the cache entries of many objects of the same level, using one ``get_many`` and one
+        ``set_many`` call. ``changes`` maps primary keys to the changed values. Falls back to discarding the cache
+        entries if no generation tracker is configured, as well as for objects that are sharded or have changed keys
+        belonging to a key group.
+        """
+        store = store_model._hierarkey_store
+        if store.hierarkey.invalidation is None:
+            # Without a new generation key, writing back the patched entry could undo a concurrent change
+            objs = [store.model() if store_model._hierarkey_is_global else store.model(pk=pk) for pk in changes]
+            cls._flush_many(store_model, objs)
+            return
+        proxies = {}
+        flush = []
+        for pk, values in changes.items():
+            obj = store.model() if store_model._hierarkey_is_global else store.model(pk=pk)
+            grouped = any(store.hierarkey.defaults[key].group is not None for key in values
+                          if key in store.hierarkey.defaults)
+            if store.cache.shards or grouped:
+                flush.append(obj)
+            else:
+                proxy = cls._create(obj, store.hierarkey, store.cache_namespace, type=store_model, cache=store.cache)
+                proxies[proxy._cache_key] = proxy, values
+        if flush:
+            cls._flush_many(store_model, flush)
+        if not proxies:
+            return
+        cls._pin_many([proxy for proxy, values in proxies.values()])
+
+        backend = caches[store.cache.alias]
+        payloads = backend.get_many(list(proxies))
+        entries = {}
+        for cache_key, (proxy, values) in proxies.items():
+            # The generation is part of the cache key, so the patched entry needs to be written after the bump
+            proxy._bump_generation()
+            data = proxy._decode(payloads.get(cache_key))
+            if data is not None:
+                data.update(values)
+                entries[proxy._cache_key] = proxy._encode(data)
+        if entries:
+            backend.set_many(entries, timeout=store.cache.timeout)
+
+    @classmethod
+    def _flush_many(cls, store_model: type, objs: Iterable[Model]) -> None:
+        """
+        Discards the cache entries of many objects of the same level with a single ``delete_many`` call, as well as
+        the state of all storage objects that already exist for them.
+        """
+        store = store_model._hierarkey_store
+        attrname = '_hierarkey_proxy_{}_{}'.format(store.cache_namespace, store.hierarkey.attribute_name)
+        registry = _registry.get() or {}
+        keys = []
+        proxies = []
+        for obj in objs:
+            for proxy in (getattr(obj, attrname, None), registry.get((store.cache_namespace, obj.pk))):
+                if proxy is not None:
+                    proxy._discard_state()
+            proxy = cls._create(obj, store.hierarkey, store.cache_namespace, type=store_model, cache=store.cache)
+            proxies.append(proxy)
+            keys += proxy._external_cache_keys()
+            if store.hierarkey.invalidation is not None:
+                store.hierarkey.invalidation.bump(store.cache_namespace, obj.pk)
+        cls._pin_many(proxies)
+        if keys:
+            caches[store.cache.alias].delete_many(keys)
+
+    def _external_cache_keys(self) -> List[str]:
+        keys = [self._group_cache_key(group) for group in self._h.get_groups()]
+        if self._cache_config.shards:
+            keys += shard_cache_keys(self._cache_key, self._cache_config.shards)
+        else:
+            keys.append(self._cache_key)
+        return keys
+
     def _flush_external_cache(self):
-        cache.delete('hierarkey_{}_{}'.format(self._cache_namespace, self._obj.pk))
+        self._cache_backend.delete_many(self._external_cache_keys())
+        if stats.collectors:
+            stats.incr('invalidate', self._cache_namespace, pk=self._obj.pk)
+        self._bump_generation()
+
+    def _patch_external_cache(self, key: str, value: str) -> None:
+        """
+        Changes a single value within the cache entry of this object instead of discarding the whole entry. Falls
+        back to discarding it if no generation tracker is configured, as well as for sharded entries and keys that
+        are part of a key group.
+        """
+        default = self._h.defaults.get(key)
+        if (self._h.invalidation is None or self._cache_config.shards
+                or (default is not None and default.group is not None)):
+            # Without a new generation key, writing back the patched entry could undo a concurrent change
+            self._flush_external_cache()
+            return
+        data = self._decode(self._cache_backend.get(self._cache_key))
+        # The generation is part of the cache key, so the patched entry needs to be written after the bump
+        self._bump_generation()
+        if data is not None:
+            data[key] = value
+            self._cache_backend.set(self._cache_key, self._encode(data), timeout=self._cache_config.timeout)
+
+    def _bump_generation(self) -> None:
+        if self._h.invalidation is not None:
+            generation = self._h.invalidation.bump(self._cache_namespace, self._obj.pk)
+            # Our own state already reflects the change, so it is current at the new generation
+            for proxy in self._sharing_state():
+                if proxy._cached_obj is not None:
+                    proxy._generation = generation
+
+    def _check_current(self) -> None:
+        """
+        Discards the state of this object and its parents if they have been changed elsewhere since they were
+        loaded. Only used if a ``GenerationTracker`` is configured.
+        """
+        tracker = self._h.invalidation
+        if self._cached_obj is not None and not tracker.is_current(self._cache_namespace, self._obj.pk, self._generation):
+            self._discard_state()
+        if self._parent:
+            self._parent_proxy._check_current()
 
     def freeze(self) -> dict:
         """
         Returns a dictionary of all settings set for this object, including
         any values of its parents or hardcoded defaults.
         """
+        if self._h.invalidation is not None:
+            self._check_current()
+
         settings = {}
-        for key, v in self._h.defaults.items():
-            settings[key] = self._unserialize(v.value, v.type)
+        for key in self._h.defaults:
+            if self._keys is None or key in self._keys:
+                settings[key] = self._h._default_value(key)
         if self._parent:
-            settings.update(getattr(self._parent, self._h.attribute_name).freeze())
+            settings.update(self._parent_proxy.freeze())
         for key in self._cache():
-            settings[key] = self.get(key)
+            if not self._batch or self._batch.get(key) is not _DELETED:
+                settings[key] = self.get(key)
+        for key, value in self._batch.items() if self._batch else ():
+            if value is not _DELETED:
+                settings[key] = self.get(key)
         return settings
 
-    def _unserialize(self, value: str, as_type: type, binary_file=False) -> Any:
-        if as_type is None and value is not None and value.startswith('file://'):
-            as_type = File
+    def snapshot(self) -> 'HierarkeySnapshot':
+        """
+        Returns an immutable snapshot of all settings of this object, including any values of its parents or
+        hardcoded defaults. Unlike this object, the snapshot is safe to share between threads. Values are
+        deserialized when they are read from the snapshot, just like they are with ``get()``.
+        """
+        if self._h.invalidation is not None:
+            self._check_current()
 
-        if as_type is not None and isinstance(value, as_type):
-            return value
-        elif value is None:
-            return None
-        elif as_type == int or as_type == float or as_type == decimal.Decimal:
-            return as_type(value)
-        elif as_type == dict or as_type == list:
-            return json.loads(value)
-        elif as_type == bool or value in ('True', 'False'):
-            return value == 'True'
-        elif as_type == File:
-            try:
-                fi = default_storage.open(value[7:], 'rb' if binary_file else 'r')
-                fi.url = default_storage.url(value[7:])
-                return fi
-            except OSError:
-                return False
-        elif as_type == datetime:
-            return dateutil.parser.parse(value)
-        elif as_type == date:
-            return dateutil.parser.parse(value).date()
-        elif as_type == time:
-            return dateutil.parser.parse(value).time()
-        elif as_type is not None:
-            for t in self._h.types:
-                if issubclass(as_type, t.type):
-                    return t.unserialize(value)
-
-        if as_type is not None and issubclass(as_type, Model):
-            return as_type.objects.get(pk=value)
+        items = {
+            key: v.value for key, v in self._h.defaults.items()
+            if v.value is not None and (self._keys is None or key in self._keys)
+        }
+        items.update(self._stored_items())
+        generation = None
+        if self._h.invalidation is not None:
+            generation = tuple(self._generations())
+        return HierarkeySnapshot(self._h, items, generation)
+
+    def _stored_items(self) -> Dict[str, str]:
+        inherited = self._parent_proxy._stored_items() if self._parent else {}
+        cache = self._cache()
+        items = {**inherited, **{key: cache[key] for key in cache}}
+        for key, value in self._batch.items() if self._batch else ():
+            if value is not _DELETED:
+                items[key] = value
+            elif key in inherited:
+                items[key] = inherited[key]
+            else:
+                items.pop(key, None)
+        return items
+
+    def _generations(self):
+        self._cache()
+        yield self._cache_namespace, self._obj.pk, self._generation
+        if self._parent:
+            yield from self._parent_proxy._generations()
 
-        return value
+    def _unserialize(self, value: str, as_type: type, binary_file=False) -> Any:
+        return self._h._unserialize(value, as_type, binary_file=binary_file)
 
     def _serialize(self, value: Any) -> str:
-        if isinstance(value, str):
-            return value
-        elif isinstance(value, int) or isinstance(value, float) \
-                or isinstance(value, bool) or isinstance(value, decimal.Decimal):
-            return str(value)
-        elif isinstance(value, list) or isinstance(value, dict):
-            return json.dumps(value)
-        elif isinstance(value, datetime) or isinstance(value, date) or isinstance(value, time):
-            return value.isoformat()
-        elif isinstance(value, Model):
-            return value.pk
-        elif isinstance(value, File):
-            return 'file://' + value.name
-        else:
-            for t in self._h.types:
-                if isinstance(value, t.type):
-                    return t.serialize(value)
-
-        raise TypeError('Unable to serialize %s into a setting.' % str(type(value)))
+        return self._h._serialize(value)
 
     def get(self, key: str, default=None, as_type: type = None, binary_file: bool = False):
         """
@@ -148,21 +592,75 @@ class HierarkeyProxy:
         If you receive a ``File`` object, it will already be opened. You can specify the ``binary_file``
         flag to indicate that it should be opened in binary mode.
         """
+        if self._keys is not None and key not in self._keys:
+            raise KeyNotLoaded('The key "{}" is not part of the loaded key groups {}.'.format(key, ', '.join(self._groups)))
+
         if as_type is None:
             as_type = self._h.get_declared_type(key)
 
+        if self._h.invalidation is not None:
+            self._check_current()
+
+        value = self._resolve(key)
+        from_default = value is None and key in self._h.defaults and self._h.defaults[key].value is not None
+        if value is None and not from_default:
+            value = default
+
+        if stats.collectors:
+            stats.incr('read', self._cache_namespace, pk=self._obj.pk, key=key, level=self._level_of(key))
+            start = time.perf_counter()
+            if from_default:
+                value = self._h._default_value(key, as_type, binary_file=binary_file)
+            else:
+                value = self._unserialize(value, as_type, binary_file=binary_file)
+            stats.timing('unserialize', self._cache_namespace, time.perf_counter() - start, pk=self._obj.pk, key=key)
+            return value
+        if from_default:
+            return self._h._default_value(key, as_type, binary_file=binary_file)
+        return self._unserialize(value, as_type, binary_file=binary_file)
+
+    def _level_of(self, key: str) -> Optional[str]:
+        """
+        Returns the cache namespace of the level the value for ``key`` is taken from, ``'default'`` for hardcoded
+        defaults or ``None`` if there is no value at all. Only used for instrumentation.
+        """
         if key in self._cache():
-            value = self._cache()[key]
-        else:
-            value = None
-            if self._parent:
-                value = getattr(self._parent, self._h.attribute_name).get(key, as_type=str)
-            if value is None and key in self._h.defaults:
-                value = self._h.defaults[key].value
-            if value is None and default is not None:
-                value = default
+            return self._cache_namespace
+        if self._parent:
+            return self._parent_proxy._level_of(key)
+        return 'default' if key in self._h.defaults else None
 
-        return self._unserialize(value, as_type, binary_file=binary_file)
+    def _resolve(self, key: str) -> Optional[str]:
+        """
+        Returns the serialized value stored for ``key`` on this level or the closest parent level that has one.
+        The result of walking up the hierarchy is remembered until any level along the way is changed.
+        """
+        if self._batch and key in self._batch:
+            value = self._batch[key]
+            if value is not _DELETED:
+                return value
+            return self._parent_proxy._resolve(key) if self._parent else None
+        cache = self._cache()
+        if key in cache:
+            return cache[key]
+        if not self._parent:
+            return None
+        if self._resolved is None:
+            self._resolved = {}
+        elif key in self._resolved:
+            return self._resolved[key]
+        parent = self._parent_proxy
+        with tracing.span('hierarkey.resolve', self._cache_namespace, self._obj.pk, key=key):
+            value = self._resolved[key] = parent._resolve(key)
+        if parent._dependents is None:
+            parent._dependents = weakref.WeakSet()
+        parent._dependents.add(self)
+        return value
+
+    def _invalidate_resolved(self) -> None:
+        self._resolved = None
+        for proxy in [*(self._dependents or ()), *(self._restricted.values() if self._restricted else ())]:
+            proxy._invalidate_resolved()
 
     def __getitem__(self, key: str) -> Any:
         return self.get(key)
@@ -180,32 +678,188 @@ class HierarkeyProxy:
     def __setitem__(self, key: str, value: Any) -> None:
         self.set(key, value)
 
-    @cached_property
-    def __is_global(self):
-        return "object" not in [f.name for f in self._type._meta.fields]
+    def _object_attributes(self) -> Dict[str, Any]:
+        return {} if self._type._hierarkey_is_global else {'object': self._obj}
+
+    def _stored(self, key: str):
+        """
+        Returns a queryset of the row storing ``key`` on this level.
+        """
+        return self._type.objects.filter(key=key, **self._object_attributes())
+
+    def _apply(self, key: str, value: str) -> None:
+        """
+        Updates the state of this object and its cache entry after ``key`` has been changed to ``value`` in the
+        database.
+        """
+        self._update_state(key, value)
+        self._pin_to_primary()
+        self._patch_external_cache(key, value)
+
+    def _update_state(self, key: str, value: Any) -> None:
+        """
+        Changes ``key`` to the serialized ``value``, or removes it if ``value`` is ``_DELETED``, within the loaded
+        values of this object and all storage objects sharing its state.
+        """
+        proxies = self._sharing_state()
+        for proxy in proxies:
+            cached = proxy._cached_obj
+            if cached is None or (proxy._keys is not None and key not in proxy._keys):
+                continue
+            if value is not _DELETED:
+                cached[key] = value
+            elif key in cached:
+                del cached[key]
+        proxies[0]._invalidate_resolved()
+
+    def _buffer(self, key: str, value: str) -> None:
+        """
+        Keeps a new value of a write-behind key within this object and the write-behind buffer, without writing it
+        to the database or touching the cache entry.
+        """
+        self._update_state(key, value)
+        writebehind.add(self._type, self._obj.pk, key, value)
+
+    def increment(self, key: str, delta: int = 1) -> int:
+        """
+        Adds ``delta`` to the integer stored for ``key`` and returns the new value. The addition is performed by the
+        database, so increments made concurrently by other processes are never lost. If the key is not set on this
+        object yet, counting starts at the inherited value, the hardcoded default or ``0``.
+
+        If a generation tracker is configured, only the changed value is updated within the cache entry of this
+        object instead of discarding the entry.
+        """
+        if key in writebehind.pending(self._type, self._obj.pk):
+            writebehind.flush()
+        with tracing.span('hierarkey.increment', self._cache_namespace, self._obj.pk, key=key):
+            stored = self._stored(key)
+            increased = Cast(Cast(F('value'), BigIntegerField()) + delta, TextField())
+            with transaction.atomic(using=router.db_for_write(self._type)):
+                if not stored.update(value=increased):
+                    initial = self._parent_proxy._resolve(key) if self._parent else None
+                    if initial is None and key in self._h.defaults:
+                        initial = self._h.defaults[key].value
+                    try:
+                        with transaction.atomic(using=router.db_for_write(self._type)):
+                            self._type.objects.create(key=key, value=str(int(initial or 0) + delta),
+                                                      **self._object_attributes())
+                    except IntegrityError:
+                        # Somebody else created the row in the meantime
+                        stored.update(value=increased)
+                value = stored.values_list('value', flat=True).get()
+            if stats.collectors:
+                stats.incr('write', self._cache_namespace, pk=self._obj.pk, key=key)
+            self._apply(key, value)
+            return int(value)
+
+    def compare_and_set(self, key: str, expected: Any, value: Any) -> bool:
+        """
+        Stores ``value`` for ``key``, but only if the value currently stored on this object equals ``expected``,
+        and returns whether the value has been stored. Pass ``expected=None`` to only store the value if the key
+        is not set on this object. The comparison is performed by the database, so no other process can change
+        the value in between.
+
+        If a generation tracker is configured, only the changed value is updated within the cache entry of this
+        object instead of discarding the entry.
+        """
+        if key in writebehind.pending(self._type, self._obj.pk):
+            writebehind.flush()
+        with tracing.span('hierarkey.compare_and_set', self._cache_namespace, self._obj.pk, key=key):
+            serialized_value = self._serialize(value)
+            if expected is None:
+                try:
+                    with transaction.atomic(using=router.db_for_write(self._type)):
+                        self._type.objects.create(key=key, value=serialized_value, **self._object_attributes())
+                except IntegrityError:
+                    return False
+            elif not self._stored(key).filter(value=self._serialize(expected)).update(value=serialized_value):
+                return False
+            if stats.collectors:
+                stats.incr('write', self._cache_namespace, pk=self._obj.pk, key=key)
+            self._apply(key, serialized_value)
+            return True
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager. Within this context, changes made through this storage object are collected instead of
+        being written immediately. Reading a value within the context already returns the changed value. When
+        the context is left, all changes are written within one transaction, using one query for all changed and
+        one query for all deleted keys, and the cache is invalidated once. If the context is left with an
+        exception, all changes are discarded.
+
+        Nested calls join the outermost batch.
+        """
+        if self._batch is not None:
+            yield self
+            return
+        self._batch = {}
+        try:
+            yield self
+        except BaseException:
+            self._batch = None
+            self._invalidate_resolved()
+            raise
+        pending, self._batch = self._batch, None
+        if pending:
+            self._write_batch(pending)
+
+    def _write_batch(self, pending: Dict[str, Any]) -> None:
+        changed = {key: value for key, value in pending.items() if value is not _DELETED}
+        deleted = [key for key, value in pending.items() if value is _DELETED]
+        key_attributes = self._object_attributes()
+
+        with tracing.span('hierarkey.batch', self._cache_namespace, self._obj.pk, key_count=len(pending)):
+            with transaction.atomic(using=router.db_for_write(self._type)):
+                if deleted:
+                    self._type.objects.filter(key__in=deleted, **key_attributes).delete()
+                if changed:
+                    self._type.objects.bulk_create(
+                        [self._type(key=key, value=value, **key_attributes) for key, value in changed.items()],
+                        update_conflicts=True, update_fields=['value'],
+                        unique_fields=['key'] if self._type._hierarkey_is_global else ['object', 'key'],
+                    )
+            writebehind.discard(self._type, self._obj.pk, *pending)
+
+            for key, value in pending.items():
+                self._update_state(key, value)
+            self._pin_to_primary()
+            self._flush_external_cache()
 
     def set(self, key: str, value: Any) -> None:
         """
         Stores a setting in the database and connects it to its object.
 
         The write to the database is performed immediately and the cache in the cache backend is flushed.
-        The cache within this object will be updated correctly.
+        The cache within this object will be updated correctly. Keys declared with ``write_behind=True`` are
+        buffered instead and written later, without flushing the cache.
         """
-        serialized_value = self._serialize(value)
-
-        key_attributes = {
-            "key": key,
-        }
-        if not self.__is_global:
-            key_attributes["object"] = self._obj
-        s, created = self._type.objects.update_or_create(
-            **key_attributes,
-            defaults={
-                "value": serialized_value,
-            }
-        )
-        self._cache()[key] = s.value
-        self._flush_external_cache()
+        with tracing.span('hierarkey.set', self._cache_namespace, self._obj.pk, key=key):
+            if stats.collectors:
+                start = time.perf_counter()
+                serialized_value = self._serialize(value)
+                stats.timing('serialize', self._cache_namespace, time.perf_counter() - start, pk=self._obj.pk, key=key)
+                stats.incr('write', self._cache_namespace, pk=self._obj.pk, key=key)
+            else:
+                serialized_value = self._serialize(value)
+            if self._batch is not None:
+                self._batch[key] = serialized_value
+                self._invalidate_resolved()
+                return
+            if key in self._h.defaults and self._h.defaults[key].write_behind:
+                self._buffer(key, serialized_value)
+                return
+
+            s, created = self._type.objects.update_or_create(
+                key=key,
+                **self._object_attributes(),
+                defaults={
+                    "value": serialized_value,
+                }
+            )
+            self._update_state(key, s.value)
+            self._pin_to_primary()
+            self._flush_external_cache()
 
     def __delattr__(self, key: str) -> None:
         if key.startswith('_'):  # pragma: no cover
@@ -222,15 +876,106 @@ class HierarkeyProxy:
         The write to the database is performed immediately and the cache in the cache backend is flushed.
         The cache within this object will be updated correctly.
         """
-        key_attributes = {
-            "key": key,
-        }
-        if not self.__is_global:
-            key_attributes["object"] = self._obj
+        with tracing.span('hierarkey.delete', self._cache_namespace, self._obj.pk, key=key):
+            if self._batch is not None:
+                if stats.collectors:
+                    stats.incr('delete', self._cache_namespace, pk=self._obj.pk, key=key)
+                self._batch[key] = _DELETED
+                self._invalidate_resolved()
+                return
 
-        self._type.objects.filter(**key_attributes).delete()
+            self._stored(key).delete()
+            writebehind.discard(self._type, self._obj.pk, key)
+            if stats.collectors:
+                stats.incr('delete', self._cache_namespace, pk=self._obj.pk, key=key)
 
-        if key in self._cache():
-            del self._cache()[key]
+            self._update_state(key, _DELETED)
+            self._pin_to_primary()
+            self._flush_external_cache()
 
-        self._flush_external_cache()
+
+class HierarkeySnapshot(Mapping):
+    """
+    An immutable snapshot of all settings of an object at one point in time, returned by
+    :py:meth:`HierarkeyProxy.snapshot() <hierarkey.proxy.HierarkeyProxy.snapshot>`. Snapshots are hashable
+    and can be compared with each other.
+
+    This class allows access to settings via attribute access, item access or ``get()``, just like the storage
+    object itself, but does not allow any changes.
+    """
+    __slots__ = ('_h', '_items', '_generation', '_hash')
+
+    def __init__(self, hierarkey: Hierarkey, items: Dict[str, str], generation=None):
+        object.__setattr__(self, '_h', hierarkey)
+        object.__setattr__(self, '_items', MappingProxyType(items))
+        object.__setattr__(self, '_generation', generation)
+        object.__setattr__(self, '_hash', hash(frozenset(items.items())))
+
+    @property
+    def generation(self) -> Optional[tuple]:
+        """
+        The generations of all levels this snapshot has been taken from, if a ``GenerationTracker`` is
+        configured.
+        """
+        return self._generation
+
+    def is_current(self) -> bool:
+        """
+        Returns whether none of the levels this snapshot has been taken from have been changed since. This
+        requires a ``GenerationTracker`` to be configured, otherwise ``False`` is always returned.
+        """
+        tracker = self._h.invalidation
+        if tracker is None or self._generation is None:
+            return False
+        return all(tracker.is_current(namespace, pk, generation) for namespace, pk, generation in self._generation)
+
+    def get(self, key: str, default=None, as_type: type = None, binary_file: bool = False):
+        """
+        Get a setting specified by ``key``, see :py:meth:`HierarkeyProxy.get() <hierarkey.proxy.HierarkeyProxy.get>`.
+        """
+        if as_type is None:
+            as_type = self._h.get_declared_type(key)
+        value = self._items.get(key)
+        if value is None:
+            value = default
+        return self._h._unserialize(value, as_type, binary_file=binary_file)
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._items:
+            raise KeyError(key)
+        return self.get(key)
+
+    def __getattr__(self, key: str) -> Any:
+        if key.startswith('_'):  # pragma: no cover
+            return super().__getattribute__(key)
+        return self.get(key)
+
+    def __setattr__(self, key: str, value: Any) -> None:
+        raise TypeError('Snapshots cannot be changed.')
+
+    def __delattr__(self, key: str) -> None:
+        raise TypeError('Snapshots cannot be changed.')
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key) -> bool:
+        return key in self._items
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, HierarkeySnapshot):
+            return NotImplemented
+        if self._hash != other._hash:
+            return False
+        if self._generation is not None and self._generation == other._generation:
+            return True
+        return self._items == other._items
+
+    def __repr__(self) -> str:
+        return '<HierarkeySnapshot: {} keys>'.format(len(self._items))
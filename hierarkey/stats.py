@@ -0,0 +1,133 @@
+"""
+Instrumentation of storage access. Register a collector to receive counters and timings::
+
+    from hierarkey import stats
+
+    stats.register(stats.CounterCollector())
+
+As long as no collector is registered, instrumentation is skipped entirely.
+
+The following metrics are reported, each with the cache namespace of the storage level they belong to:
+
+* ``proxy_created`` (counter) for every storage object created
+* ``read`` (counter) for every value read, with the namespace of the ``level`` the value was taken from
+  (``'default'`` for hardcoded defaults, ``None`` if there is no value)
+* ``fetch`` (counter) for every time a storage object fetches the values of its object from the cache or database
+* ``cache_hit`` and ``cache_miss`` (counters) for every entry looked up in the cache backend
+* ``db_load`` (counter and timing) for every database query loading values, ``db_rows`` (counter) for the number
+  of values loaded
+* ``decode`` (timing) for decoding an entry fetched from the cache backend
+* ``serialize`` and ``unserialize`` (timings) for converting single values
+* ``write`` and ``delete`` (counters) for every value written or deleted
+* ``invalidate`` (counter) for every time the cache entries of an object are discarded
+"""
+from typing import List, NamedTuple, Tuple
+
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+collectors: Tuple['StatsCollector', ...] = ()
+_recording = ContextVar('hierarkey_recording', default=None)
+
+
+class StatsCollector:
+    """
+    Base class for collectors. All methods do nothing by default. Additional context, like the primary key
+    of the object (``pk``), the ``key`` of a value or the ``cache_key`` of a cache entry, is passed as keyword
+    arguments where available.
+    """
+
+    def incr(self, metric: str, namespace: str, value: int = 1, **context) -> None:
+        pass
+
+    def timing(self, metric: str, namespace: str, seconds: float, **context) -> None:
+        pass
+
+
+class CounterCollector(StatsCollector):
+    """
+    Aggregates all counters and timings in memory, keyed by ``(namespace, metric)``.
+    """
+
+    def __init__(self):
+        self.counters = Counter()
+        self.timings = defaultdict(float)
+
+    def incr(self, metric: str, namespace: str, value: int = 1, **context) -> None:
+        self.counters[namespace, metric] += value
+
+    def timing(self, metric: str, namespace: str, seconds: float, **context) -> None:
+        self.timings[namespace, metric] += seconds
+
+    def reset(self) -> None:
+        self.counters.clear()
+        self.timings.clear()
+
+
+class StatsEvent(NamedTuple):
+    kind: str
+    metric: str
+    namespace: str
+    value: float
+    context: dict
+
+
+class RecordingCollector(StatsCollector):
+    """
+    Records every single event in order in ``events``. Other than the other collectors, this collector only
+    receives events from the thread or async task that called :py:meth:`start`, which allows one recorder per
+    request.
+    """
+
+    def __init__(self):
+        self.events: List[StatsEvent] = []
+        self._token = None
+
+    def start(self) -> None:
+        if self._token is None:
+            self._token = _recording.set(self)
+            register(self)
+
+    def stop(self) -> None:
+        if self._token is not None:
+            unregister(self)
+            try:
+                _recording.reset(self._token)
+            except ValueError:
+                # stop() was called from a different context than start()
+                _recording.set(None)
+            self._token = None
+
+    def incr(self, metric: str, namespace: str, value: int = 1, **context) -> None:
+        if _recording.get() is self:
+            self.events.append(StatsEvent('incr', metric, namespace, value, context))
+
+    def timing(self, metric: str, namespace: str, seconds: float, **context) -> None:
+        if _recording.get() is self:
+            self.events.append(StatsEvent('timing', metric, namespace, seconds, context))
+
+
+def register(collector: StatsCollector) -> None:
+    """
+    Starts sending all metrics to the given collector.
+    """
+    global collectors
+    collectors = collectors + (collector,)
+
+
+def unregister(collector: StatsCollector) -> None:
+    """
+    Stops sending metrics to the given collector.
+    """
+    global collectors
+    collectors = tuple(c for c in collectors if c is not collector)
+
+
+def incr(metric: str, namespace: str, value: int = 1, **context) -> None:
+    for collector in collectors:
+        collector.incr(metric, namespace, value, **context)
+
+
+def timing(metric: str, namespace: str, seconds: float, **context) -> None:
+    for collector in collectors:
+        collector.timing(metric, namespace, seconds, **context)
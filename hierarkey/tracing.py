@@ -0,0 +1,45 @@
+"""
+Optional integration with OpenTelemetry. If the ``opentelemetry-api`` package is installed, storage access is
+wrapped in spans named ``hierarkey.*`` that carry the cache namespace, the primary key of the object and further
+details as attributes. Otherwise, tracing is skipped entirely.
+"""
+from typing import Any, ContextManager
+
+from contextlib import nullcontext
+
+try:
+    from opentelemetry import trace
+except ImportError:  # pragma: no cover
+    trace = None
+
+tracer = trace.get_tracer('hierarkey') if trace is not None else None
+_noop = nullcontext()
+
+
+def _attribute(value: Any) -> Any:
+    return value if isinstance(value, (str, bool, int, float)) else str(value)
+
+
+def span(name: str, namespace: str = None, pk: Any = None, **attributes) -> ContextManager:
+    """
+    Returns a context manager wrapping its body in a span called ``name``. Additional attributes are prefixed
+    with ``hierarkey.``.
+    """
+    if tracer is None:
+        return _noop
+    attributes['namespace'] = namespace
+    attributes['pk'] = pk
+    return tracer.start_as_current_span(name, attributes={
+        'hierarkey.' + k: _attribute(v) for k, v in attributes.items() if v is not None
+    })
+
+
+def annotate(**attributes) -> None:
+    """
+    Adds attributes, prefixed with ``hierarkey.``, to the current span.
+    """
+    if tracer is None:
+        return
+    trace.get_current_span().set_attributes({
+        'hierarkey.' + k: _attribute(v) for k, v in attributes.items() if v is not None
+    })
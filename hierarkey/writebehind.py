@@ -0,0 +1,115 @@
+"""
+Buffers writes to keys declared with ``write_behind=True`` (see
+:py:meth:`Hierarkey.add_default() <hierarkey.models.Hierarkey.add_default>`) within the current process. Repeated
+writes to the same key are coalesced and all buffered values are written to the database with one query per
+level at most every ``FLUSH_INTERVAL`` seconds.
+"""
+from typing import Any, Dict, Tuple
+
+import atexit
+import functools
+import threading
+import time
+from django.core.signals import request_finished
+from django.db import connections, router, transaction
+
+from hierarkey import stats, tracing
+
+# Buffered values are written to the database at most this often (in seconds) per process
+FLUSH_INTERVAL = 5.0
+
+_lock = threading.Lock()
+_pending: Dict[Tuple[type, Any], Dict[str, str]] = {}
+_last_flush = time.monotonic()
+
+
+def add(store_model: type, pk: Any, key: str, value: str) -> None:
+    """
+    Buffers a serialized value and writes all buffered values if the last flush is at least ``FLUSH_INTERVAL``
+    seconds ago and no transaction is open.
+    """
+    with _lock:
+        _pending.setdefault((store_model, pk), {})[key] = value
+    # Values written within the caller's transaction would be lost if it was rolled back
+    if not connections[router.db_for_write(store_model)].in_atomic_block:
+        flush_if_due()
+
+
+def pending(store_model: type, pk: Any) -> Dict[str, str]:
+    """
+    Returns the values buffered for one object that have not been written to the database yet.
+    """
+    if not _pending:
+        return {}
+    with _lock:
+        return dict(_pending.get((store_model, pk), ()))
+
+
+def discard(store_model: type, pk: Any, *keys: str) -> None:
+    """
+    Drops buffered values that have been superseded by a write that went to the database directly.
+    """
+    if not _pending:
+        return
+    with _lock:
+        values = _pending.get((store_model, pk))
+        for key in keys if values else ():
+            values.pop(key, None)
+        if values == {}:
+            del _pending[store_model, pk]
+
+
+def flush_if_due(**kwargs) -> None:
+    if _pending and time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+        flush()
+
+
+def flush() -> None:
+    """
+    Writes all buffered values to the database and updates them within the cache entries of their objects. This
+    is called when the process exits normally. Values that are still buffered when a process is killed are lost.
+    """
+    global _pending, _last_flush
+    with _lock:
+        values, _pending = _pending, {}
+        _last_flush = time.monotonic()
+
+    try:
+        _write(values)
+    except BaseException:
+        # Keep the values buffered, unless they have been changed again in the meantime
+        with _lock:
+            for object_key, changes in values.items():
+                _pending[object_key] = {**changes, **_pending.get(object_key, {})}
+        raise
+
+
+def _write(values: Dict[Tuple[type, Any], Dict[str, str]]) -> None:
+    from hierarkey.proxy import HierarkeyProxy
+
+    by_model = {}
+    for (store_model, pk), changes in values.items():
+        by_model.setdefault(store_model, {})[pk] = changes
+
+    for store_model, changes in by_model.items():
+        store = store_model._hierarkey_store
+        with tracing.span('hierarkey.write_behind', store.cache_namespace, object_count=len(changes)):
+            if store_model._hierarkey_is_global:
+                rows = [store_model(key=key, value=value) for c in changes.values() for key, value in c.items()]
+                unique_fields = ['key']
+            else:
+                rows = [store_model(object_id=pk, key=key, value=value)
+                        for pk, c in changes.items() for key, value in c.items()]
+                unique_fields = ['object', 'key']
+            using = router.db_for_write(store_model)
+            with transaction.atomic(using=using):
+                store_model.objects.bulk_create(rows, update_conflicts=True, unique_fields=unique_fields,
+                                                update_fields=['value'])
+            if stats.collectors:
+                stats.incr('write_behind_flush', store.cache_namespace, len(rows))
+            # Runs immediately unless flush() is called within a transaction of the caller
+            transaction.on_commit(functools.partial(HierarkeyProxy._patch_many, store_model, changes), using=using)
+
+
+request_finished.connect(flush_if_due)
+atexit.register(flush)
@@ -43,6 +43,6 @@ setup(
         'python-dateutil'
     ],
 
-    packages=find_packages(exclude=['tests', 'tests.*', 'demoproject', 'demoproject.*']),
+    packages=find_packages(exclude=['tests', 'tests.*', 'demoproject', 'demoproject.*', 'benchmarks', 'benchmarks.*']),
     include_package_data=True,
 )
@@ -5,3 +5,16 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.settings")
 import django
 
 django.setup()
+
+import pytest
+
+from .testapp.models import Organization, User
+
+
+@pytest.fixture
+def user():
+    organization = Organization.objects.create(name='Foo')
+    organization.settings.flush()
+    user = User.objects.create(organization=organization, name='Bar')
+    user.settings.flush()
+    return user
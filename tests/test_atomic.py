@@ -0,0 +1,62 @@
+import pytest
+
+from .testapp.models import GlobalSettings, User, hierarkey
+
+
+@pytest.mark.django_db
+def test_increment(user, django_assert_num_queries):
+    assert user.settings.increment('counter') == 1
+    assert user.settings.increment('counter', 5) == 6
+    assert user.settings.get('counter', as_type=int) == 6
+
+    other = User.objects.select_related('organization').get(pk=user.pk)
+    other.organization.settings.freeze()
+    with django_assert_num_queries(0):
+        assert other.settings.get('counter', as_type=int) == 6
+
+    assert user.settings.increment('counter', -10) == -4
+
+
+@pytest.mark.django_db
+def test_increment_inherited(user):
+    user.organization.settings.set('counter', 10)
+    assert user.settings.increment('counter') == 11
+    assert user.organization.settings.get('counter', as_type=int) == 10
+
+    settings = GlobalSettings().settings
+    assert settings.increment('global_counter', 2) == 2
+    assert GlobalSettings().settings.get('global_counter', as_type=int) == 2
+    settings.delete('global_counter')
+
+
+@pytest.mark.django_db
+def test_increment_default(user):
+    olddef = hierarkey.defaults
+    hierarkey.defaults = dict(olddef)
+    hierarkey.add_default('counter', 100, int)
+    hierarkey.add_default('empty_counter', None, int)
+    try:
+        assert user.settings.increment('counter') == 101
+        assert user.settings.increment('empty_counter') == 1
+    finally:
+        hierarkey.defaults = olddef
+
+
+@pytest.mark.django_db
+def test_compare_and_set(user, django_assert_num_queries):
+    assert user.settings.compare_and_set('state', None, 'new')
+    assert not user.settings.compare_and_set('state', None, 'other')
+    assert not user.settings.compare_and_set('state', 'wrong', 'other')
+    assert user.settings.state == 'new'
+    assert user.settings.compare_and_set('state', 'new', 'done')
+    assert user.settings.state == 'done'
+
+    other = User.objects.select_related('organization').get(pk=user.pk)
+    other.organization.settings.freeze()
+    # Without a generation tracker, the cache entry is discarded instead of patched
+    with django_assert_num_queries(1):
+        assert other.settings.state == 'done'
+
+    assert user.settings.compare_and_set('number', None, 3)
+    assert user.settings.compare_and_set('number', 3, 4)
+    assert user.settings.get('number', as_type=int) == 4
@@ -0,0 +1,76 @@
+import pytest
+
+from .testapp.models import (
+    GlobalSettings, GlobalSettings_SettingsStore, Organization,
+    Organization_SettingsStore, User,
+)
+
+
+@pytest.mark.django_db
+def test_batch(user, django_assert_num_queries):
+    organization = user.organization
+    organization.settings.set('a', 'old')
+    organization.settings.set('c', 'old')
+    organization.settings.set('d', 'old')
+    assert user.settings.c == 'old'
+    organization.settings.freeze()
+
+    with organization.settings.batch():
+        with django_assert_num_queries(0):
+            organization.settings.a = 'new'
+            organization.settings.set('b', 42)
+            del organization.settings.c
+            assert organization.settings.a == 'new'
+            assert organization.settings.get('b', as_type=int) == 42
+            assert organization.settings.c is None
+            assert user.settings.a == 'new'
+            assert user.settings.c is None
+            assert organization.settings.freeze() == {'a': 'new', 'b': '42', 'd': 'old'}
+            assert dict(organization.settings.snapshot()) == {'a': 'new', 'b': '42', 'd': 'old'}
+        assert Organization_SettingsStore.objects.filter(key='a').get().value == 'old'
+
+    assert Organization_SettingsStore.objects.filter(key='a').get().value == 'new'
+    assert not Organization_SettingsStore.objects.filter(key='c').exists()
+    assert (organization.settings.a, organization.settings.b, organization.settings.c) == ('new', '42', None)
+    organization = Organization.objects.get(pk=organization.pk)
+    assert (organization.settings.a, organization.settings.b, organization.settings.c) == ('new', '42', None)
+
+
+@pytest.mark.django_db
+def test_batch_queries(user, django_assert_num_queries):
+    assert user.settings.other is None
+    with django_assert_num_queries(4):
+        # SAVEPOINT, DELETE, INSERT, RELEASE SAVEPOINT
+        with user.settings.batch():
+            for i in range(10):
+                user.settings.set('key_%d' % i, i)
+            del user.settings.other
+    assert User.objects.get(pk=user.pk).settings.get('key_9', as_type=int) == 9
+
+
+@pytest.mark.django_db
+def test_batch_exception(user):
+    user.settings.set('a', 'old')
+    with pytest.raises(ValueError):
+        with user.settings.batch():
+            user.settings.set('a', 'new')
+            user.settings.set('b', 'new')
+            raise ValueError()
+    assert (user.settings.a, user.settings.b) == ('old', None)
+    user = User.objects.get(pk=user.pk)
+    assert (user.settings.a, user.settings.b) == ('old', None)
+
+
+@pytest.mark.django_db
+def test_batch_nested_and_global():
+    settings = GlobalSettings().settings
+    stored = GlobalSettings_SettingsStore.objects
+    with settings.batch():
+        settings.set('a', 'outer')
+        with settings.batch():
+            settings.set('b', 'inner')
+        assert not stored.filter(key='b').exists()
+    assert dict(stored.values_list('key', 'value')) == {'a': 'outer', 'b': 'inner'}
+    assert GlobalSettings().settings.b == 'inner'
+    settings.delete('a')
+    settings.delete('b')
@@ -0,0 +1,11 @@
+import pytest
+
+from benchmarks.scenarios import SCENARIOS
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('name', list(SCENARIOS))
+def test_benchmark_scenario(name):
+    # Only makes sure the benchmarks keep working, see benchmarks/run.py for running them
+    prepare, run = SCENARIOS[name].function(1)
+    run(prepare())
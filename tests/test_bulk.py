@@ -0,0 +1,86 @@
+import pytest
+
+from .testapp.models import (
+    GlobalSettings, Organization, Organization_SettingsStore, User, hierarkey,
+)
+
+
+@pytest.fixture
+def organizations():
+    orgs = [Organization.objects.create(name='Org {}'.format(i)) for i in range(4)]
+    for o in orgs:
+        o.settings.flush()
+    return orgs
+
+
+@pytest.mark.django_db
+def test_clone(organizations, django_assert_num_queries):
+    source, *targets = organizations
+    source.settings.set('a', 'source')
+    source.settings.set('b', [1, 2])
+    targets[0].settings.set('a', 'target')
+    assert targets[1].settings.a is None
+
+    with django_assert_num_queries(2):
+        hierarkey.clone(source, targets)
+    assert targets[0].settings.a == 'source'
+    assert targets[1].settings.a == 'source'
+    assert targets[1].settings.get('b', as_type=list) == [1, 2]
+    assert Organization.objects.get(pk=targets[2].pk).settings.a == 'source'
+    assert Organization_SettingsStore.objects.count() == 8
+
+
+@pytest.mark.django_db
+def test_clone_only_missing(organizations):
+    source, *targets = organizations
+    source.settings.set('a', 'source')
+    source.settings.set('b', 'source')
+    targets[0].settings.set('a', 'target')
+
+    hierarkey.clone(source, targets, only_missing=True, batch_size=3)
+    assert (targets[0].settings.a, targets[0].settings.b) == ('target', 'source')
+    assert (targets[1].settings.a, targets[1].settings.b) == ('source', 'source')
+    assert Organization_SettingsStore.objects.count() == 8
+
+
+@pytest.mark.django_db
+def test_clone_invalid(organizations):
+    user = User.objects.create(organization=organizations[0], name='Bar')
+    with pytest.raises(ValueError):
+        hierarkey.clone(GlobalSettings(), [GlobalSettings()])
+    with pytest.raises(ValueError):
+        hierarkey.clone(organizations[0].settings, organizations[1:])
+    organizations[0].settings.set('a', 'source')
+    with pytest.raises(ValueError):
+        hierarkey.clone(organizations[0], [user])
+
+
+@pytest.mark.django_db
+def test_set_for_queryset(organizations, django_assert_max_num_queries):
+    organizations[0].settings.set('a', 'old')
+    assert organizations[0].settings.a == 'old'
+
+    with django_assert_max_num_queries(2):
+        hierarkey.set_for_queryset(Organization.objects.exclude(pk=organizations[3].pk), 'a', 42)
+    for o in Organization.objects.all():
+        assert o.settings.get('a', as_type=int) == (None if o.pk == organizations[3].pk else 42)
+    assert Organization_SettingsStore.objects.count() == 3
+
+    hierarkey.set_for_queryset(Organization.objects.all(), 'a', 'new', batch_size=3)
+    assert {o.settings.a for o in Organization.objects.all()} == {'new'}
+
+
+@pytest.mark.django_db
+def test_delete_for_queryset(organizations):
+    user = User.objects.create(organization=organizations[0], name='Bar')
+    for o in organizations:
+        o.settings.set('a', o.name)
+        o.settings.set('b', o.name)
+    user.settings.set('a', 'user')
+    assert Organization.objects.get(pk=organizations[0].pk).settings.a == 'Org 0'
+
+    hierarkey.delete_for_queryset(Organization.objects.filter(name__in=['Org 0', 'Org 1', 'Org 2']), 'a',
+                                  batch_size=2)
+    assert [o.settings.a for o in Organization.objects.order_by('pk')] == [None, None, None, 'Org 3']
+    assert {o.settings.b for o in Organization.objects.all()} == {'Org 0', 'Org 1', 'Org 2', 'Org 3'}
+    assert User.objects.get(pk=user.pk).settings.a == 'user'
@@ -0,0 +1,158 @@
+import hashlib
+import pickle
+import pytest
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.exceptions import ImproperlyConfigured
+
+from hierarkey.cache import CompactCodec, shard_cache_keys
+from hierarkey.models import Hierarkey, HierarkeyCache
+from hierarkey.proxy import HierarkeyProxy
+
+from .testapp.models import (
+    GlobalSettings, GlobalSettings_SettingsStore, Organization,
+    Organization_SettingsStore, hierarkey,
+)
+
+
+def test_compact_codec_roundtrip():
+    codec = CompactCodec(compress_threshold=16)
+    data = {'short': 'a', 'long': 'x' * 1000, 'unicode': 'äöü' * 20, 'empty': ''}
+    assert codec.decode(codec.encode(data)) == data
+    assert codec.decode(codec.encode({})) == {}
+
+
+def test_compact_codec_smaller_than_pickle():
+    codec = CompactCodec()
+    data = {'key_%d' % i: '{"value": "%s"}' % ('abc' * 200) for i in range(100)}
+    assert len(codec.encode(data)) < len(pickle.dumps(data)) / 10
+
+
+def test_compact_codec_rejects_unknown_payload():
+    codec = CompactCodec()
+    assert codec.decode({'foo': 'bar'}) is None
+    assert codec.decode(b'\xff' + codec.encode({'foo': 'bar'})[1:]) is None
+
+
+def test_compact_codec_rejects_corrupt_payload():
+    codec = CompactCodec(compress_threshold=16)
+    payload = codec.encode({'short': 'a', 'long': 'x' * 1000, 'unicode': 'äöü'})
+    for length in range(len(payload)):
+        assert codec.decode(payload[:length]) is None
+    corrupt = bytearray(payload)
+    corrupt[-5] ^= 0xff
+    assert codec.decode(bytes(corrupt)) is None
+    compressed = bytearray(codec.encode({'long': 'x' * 1000}))
+    compressed[-3] ^= 0xff
+    assert codec.decode(bytes(compressed)) is None
+
+
+def test_compact_codec_unknown_compression():
+    with pytest.raises(ImproperlyConfigured):
+        CompactCodec(compression='lzma')
+
+
+@pytest.mark.django_db
+def test_compact_codec_in_cache():
+    codec = CompactCodec(compress_threshold=16)
+    organization = Organization.objects.create(name='Foo')
+    config = HierarkeyCache(alias='default', timeout=60, prefix='compact', codec=codec)
+
+    def proxy():
+        return HierarkeyProxy._new(organization, hierarkey=hierarkey, cache_namespace='organization',
+                                   type=Organization_SettingsStore, cache=config)
+
+    proxy().set('test', 'foo' * 100)
+    assert proxy().get('test') == 'foo' * 100
+    assert codec.decode(caches['default'].get(proxy()._cache_key)) == {'test': 'foo' * 100}
+
+
+def _sharded_proxy(organization, **kwargs):
+    config = HierarkeyCache(alias='default', timeout=60, prefix='sharded', codec=None, shards=4, **kwargs)
+    return HierarkeyProxy._new(organization, hierarkey=hierarkey, cache_namespace='organization',
+                               type=Organization_SettingsStore, cache=config)
+
+
+@pytest.mark.django_db
+def test_sharded_cache(django_assert_num_queries):
+    organization = Organization.objects.create(name='Foo')
+    for i in range(20):
+        _sharded_proxy(organization).set('key_%d' % i, 'value_%d' % i)
+
+    with django_assert_num_queries(1):
+        assert _sharded_proxy(organization).get('key_3') == 'value_3'
+
+    base_key = _sharded_proxy(organization)._cache_key
+    assert len(caches['default'].get_many(shard_cache_keys(base_key, 4))) == 4
+
+    with django_assert_num_queries(0):
+        proxy = _sharded_proxy(organization)
+        assert proxy.get('key_3') == 'value_3'
+        assert len(proxy._cache()._buckets) == 1
+        assert proxy.get('nonexisting') is None
+        assert proxy.freeze()['key_19'] == 'value_19'
+
+    proxy.set('key_3', 'changed')
+    proxy.delete('key_4')
+    with django_assert_num_queries(1):
+        proxy = _sharded_proxy(organization)
+        assert proxy.get('key_3') == 'changed'
+        assert proxy.get('key_4') is None
+
+
+@pytest.mark.django_db
+def test_sharded_cache_large_values(django_assert_num_queries):
+    organization = Organization.objects.create(name='Foo')
+    _sharded_proxy(organization, large_value_threshold=100).set('large', 'x' * 1000)
+    _sharded_proxy(organization, large_value_threshold=100).set('small', 'y')
+    _sharded_proxy(organization, large_value_threshold=100).get('small')
+
+    base_key = _sharded_proxy(organization)._cache_key
+    for payload in caches['default'].get_many(shard_cache_keys(base_key, 4)).values():
+        assert 'x' * 1000 not in payload[0].values()
+
+    with django_assert_num_queries(0):
+        assert _sharded_proxy(organization, large_value_threshold=100).get('large') == 'x' * 1000
+
+    caches['default'].delete('%s_v_%s' % (base_key, hashlib.sha1(('x' * 1000).encode()).hexdigest()))
+    with django_assert_num_queries(1):
+        assert _sharded_proxy(organization, large_value_threshold=100).get('large') == 'x' * 1000
+
+
+@pytest.mark.django_db
+def test_flush_namespace(django_assert_num_queries):
+    organizations = [Organization.objects.create(name='Org {}'.format(i)) for i in range(3)]
+    for o in organizations:
+        o.settings.set('test', 'old')
+        assert Organization.objects.get(pk=o.pk).settings.test == 'old'
+    GlobalSettings().settings.set('test', 'global')
+    assert GlobalSettings().settings.test == 'global'
+
+    Organization_SettingsStore.objects.update(value='new')
+    GlobalSettings_SettingsStore.objects.update(value='changed')
+    organization = Organization.objects.get(pk=organizations[0].pk)
+    with django_assert_num_queries(0):
+        assert organization.settings.test == 'old'
+
+    old_key = organizations[0].settings._cache_key
+    hierarkey.flush(Organization)
+    assert organizations[0].settings._cache_key != old_key
+    for o in Organization.objects.all():
+        assert o.settings.test == 'new'
+    assert GlobalSettings().settings.test == 'global'
+
+    hierarkey.flush()
+    assert GlobalSettings().settings.test == 'changed'
+    GlobalSettings().settings.delete('test')
+
+    with pytest.raises(ValueError):
+        hierarkey.flush(HierarkeyCache)
+
+
+def test_max_timeout():
+    assert GlobalSettings_SettingsStore._hierarkey_store.cache.timeout == 86400
+    h = Hierarkey(attribute_name='settings', cache_timeout=3600, cache_max_timeout=600)
+    assert h._cache_config(None, DEFAULT_TIMEOUT, None, None).timeout == 600
+    assert h._cache_config(None, 60, None, None).timeout == 60
+    h = Hierarkey(attribute_name='settings', cache_timeout=None, cache_max_timeout=None)
+    assert h._cache_config(None, DEFAULT_TIMEOUT, None, None).timeout is None
@@ -0,0 +1,231 @@
+import json
+import pytest
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from io import StringIO
+
+from hierarkey.management.commands.hierarkey_compact import (
+    Command as CompactCommand,
+)
+from hierarkey.models import HierarkeyDefault
+
+from .testapp.models import (
+    GlobalSettings, Organization, Organization_SettingsStore, User,
+    User_SettingsStore, hierarkey,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    caches['default'].clear()
+    caches['local'].clear()
+    yield
+    caches['default'].clear()
+    caches['local'].clear()
+
+
+@pytest.fixture
+def organizations():
+    GlobalSettings().settings.set('test', 'global')
+    orgs = [Organization.objects.create(name='Org {}'.format(i)) for i in range(5)]
+    for o in orgs:
+        o.settings.set('test', o.name)
+        o.settings.set('other', 'value')
+    User.objects.create(organization=orgs[0], name='Bar').settings.set('test', 'user')
+    caches['default'].clear()
+    caches['local'].clear()
+    return orgs
+
+
+@pytest.mark.django_db
+def test_warm_cache(organizations, django_assert_num_queries):
+    out = StringIO()
+    call_command('hierarkey_warm_cache', chunk_size=2, stdout=out)
+    assert 'organization: 5 objects, 10 values, 5 cache entries' in out.getvalue()
+    assert 'user: 1 objects, 1 values, 1 cache entries' in out.getvalue()
+    assert 'global: 1 objects' in out.getvalue()
+    assert 'Warmed 7 objects' in out.getvalue()
+
+    orgs = list(Organization.objects.all())
+    with django_assert_num_queries(0):
+        for o in orgs:
+            assert o.settings.test == o.name
+            assert o.settings.other == 'value'
+        assert GlobalSettings().settings.test == 'global'
+
+
+@pytest.mark.django_db
+def test_warm_cache_filters(organizations):
+    out = StringIO()
+    call_command('hierarkey_warm_cache', namespace=['organization'], min_pk=organizations[1].pk,
+                 max_pk=organizations[3].pk, stdout=out)
+    assert 'organization: 3 objects' in out.getvalue()
+    assert 'user:' not in out.getvalue()
+    warmed = {o.pk for o in organizations if caches['default'].get(o.settings._cache_key)}
+    assert warmed == {o.pk for o in organizations[1:4]}
+
+    caches['default'].clear()
+    call_command('hierarkey_warm_cache', '--namespace=organization', '--filter=name=Org 4', stdout=out)
+    assert caches['default'].get(organizations[4].settings._cache_key) is not None
+    assert caches['default'].get(organizations[0].settings._cache_key) is None
+
+
+@pytest.mark.django_db
+def test_warm_cache_invalid():
+    with pytest.raises(CommandError):
+        call_command('hierarkey_warm_cache', namespace=['unknown'], stdout=StringIO())
+    with pytest.raises(CommandError):
+        call_command('hierarkey_warm_cache', '--filter=name', stdout=StringIO())
+
+
+@pytest.mark.django_db(databases=['default', 'replica'])
+def test_warm_cache_skips_recently_written():
+    hierarkey.read_using = 'replica'
+    try:
+        orgs = [Organization.objects.create(name='Org {}'.format(i)) for i in range(2)]
+        for o in orgs:
+            Organization.objects.using('replica').create(pk=o.pk, name=o.name)
+            Organization_SettingsStore.objects.using('replica').create(object_id=o.pk, key='test', value='old')
+        # The replica does not have this change yet
+        orgs[0].settings.set('test', 'new')
+
+        out = StringIO()
+        call_command('hierarkey_warm_cache', namespace=['organization'], stdout=out)
+        assert 'organization: skipped 1 recently changed objects.' in out.getvalue()
+        assert caches['default'].get(orgs[0].settings._cache_key) is None
+        assert caches['default'].get(orgs[1].settings._cache_key) == {'test': 'old'}
+    finally:
+        hierarkey.read_using = None
+
+
+@pytest.fixture
+def defaults():
+    olddef = hierarkey.defaults
+    hierarkey.defaults = {'flag': HierarkeyDefault(value=True, type=bool)}
+    yield
+    hierarkey.defaults = olddef
+
+
+@pytest.fixture
+def redundant(defaults):
+    GlobalSettings().settings.set('test', 'global')
+    org = Organization.objects.create(name='Foo')
+    org.settings.set('test', 'global')
+    org.settings.set('other', 'org')
+    org.settings.set('flag', True)
+    user = User.objects.create(organization=org, name='Bar')
+    user.settings.set('other', 'org')
+    user.settings.set('test', 'user')
+    user.settings.set('flag', False)
+    return user
+
+
+@pytest.mark.django_db
+def test_compact_dry_run(redundant):
+    out = StringIO()
+    call_command('hierarkey_compact', dry_run=True, stdout=out)
+    assert 'organization: would delete 2 of 3 values.' in out.getvalue()
+    assert 'user: would delete 1 of 3 values.' in out.getvalue()
+    assert 'Would delete 3 values in total.' in out.getvalue()
+    assert Organization_SettingsStore.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_compact(redundant):
+    user = User.objects.get(pk=redundant.pk)
+    assert (user.settings.test, user.settings.other, user.settings.flag) == ('user', 'org', False)
+    assert user.organization.settings.test == 'global'
+
+    call_command('hierarkey_compact', batch_size=1, stdout=StringIO())
+    assert set(Organization_SettingsStore.objects.values_list('key', flat=True)) == {'other'}
+    assert set(User_SettingsStore.objects.values_list('key', flat=True)) == {'test', 'flag'}
+
+    user = User.objects.get(pk=redundant.pk)
+    assert (user.settings.test, user.settings.other, user.settings.flag) == ('user', 'org', False)
+    assert (user.organization.settings.test, user.organization.settings.flag) == ('global', True)
+
+
+@pytest.mark.django_db
+def test_compact_keep_defaults(redundant):
+    call_command('hierarkey_compact', namespace=['organization'], keep_defaults=True, stdout=StringIO())
+    assert set(Organization_SettingsStore.objects.values_list('key', flat=True)) == {'other', 'flag'}
+    assert User_SettingsStore.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_compact_none_default(defaults):
+    hierarkey.defaults['empty'] = HierarkeyDefault(value=None, type=str)
+    org = Organization.objects.create(name='Foo')
+    org.settings.set('empty', 'x')
+    call_command('hierarkey_compact', stdout=StringIO())
+    assert Organization.objects.get(pk=org.pk).settings.empty == 'x'
+
+
+@pytest.mark.django_db
+def test_export_import(organizations, tmp_path):
+    out = StringIO()
+    call_command('hierarkey_export', stdout=out, stderr=StringIO())
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert len(lines) == 12
+    assert {'namespace': 'global', 'object': None, 'key': 'test', 'value': 'global'} in lines
+    assert {'namespace': 'organization', 'object': organizations[0].pk, 'key': 'test', 'value': 'Org 0'} in lines
+
+    out = StringIO()
+    call_command('hierarkey_export', namespace=['user'], output=str(tmp_path / 'export.jsonl'), stdout=out,
+                 stderr=StringIO())
+    assert out.getvalue() == ''
+    assert len((tmp_path / 'export.jsonl').read_text().splitlines()) == 1
+
+    org = Organization.objects.get(pk=organizations[0].pk)
+    assert org.settings.test == 'Org 0'
+    org.settings.set('test', 'changed')
+    org.settings.set('new', 'kept')
+    Organization_SettingsStore.objects.filter(object=organizations[1]).delete()
+    organizations[4].delete()
+
+    (tmp_path / 'import.jsonl').write_text('\n'.join(json.dumps(line) for line in lines) + '\n')
+    out = StringIO()
+    call_command('hierarkey_import', str(tmp_path / 'import.jsonl'), chunk_size=3, stdout=out)
+    assert 'organization: imported 8 values for 4 objects, skipped 2 values of missing objects.' in out.getvalue()
+
+    org = Organization.objects.get(pk=organizations[0].pk)
+    assert org.settings.test == 'Org 0'
+    assert org.settings.new == 'kept'
+    assert Organization.objects.get(pk=organizations[1].pk).settings.test == 'Org 1'
+    assert Organization_SettingsStore.objects.count() == 9
+    assert GlobalSettings().settings.test == 'global'
+
+
+@pytest.mark.django_db
+def test_import_invalid(tmp_path):
+    (tmp_path / 'import.jsonl').write_text('{"namespace": "unknown", "object": 1, "key": "a", "value": "b"}\n')
+    with pytest.raises(CommandError):
+        call_command('hierarkey_import', str(tmp_path / 'import.jsonl'), stdout=StringIO())
+    (tmp_path / 'import.jsonl').write_text('\n{"namespace": "organization"}\n')
+    with pytest.raises(CommandError, match='Line 2'):
+        call_command('hierarkey_import', str(tmp_path / 'import.jsonl'), stdout=StringIO())
+    (tmp_path / 'import.jsonl').write_text('{"namespace": "organization", "object": "abc", "key": "a", "value": "b"}\n')
+    with pytest.raises(CommandError, match='Line 1 does not refer to a valid object'):
+        call_command('hierarkey_import', str(tmp_path / 'import.jsonl'), stdout=StringIO())
+    (tmp_path / 'import.jsonl').write_text('{"namespace": "organization", "object": 1, "key": "a", "value": null}\n')
+    with pytest.raises(CommandError, match='Line 1 does not contain a value'):
+        call_command('hierarkey_import', str(tmp_path / 'import.jsonl'), stdout=StringIO())
+    assert not Organization_SettingsStore.objects.exists()
+
+
+@pytest.mark.django_db
+def test_compact_concurrent_change(redundant, monkeypatch):
+    batches = CompactCommand._batches
+
+    def changing_batches(self, store_model, batch_size):
+        for batch in batches(self, store_model, batch_size):
+            # Simulates a change made by another process after the values have been compared
+            Organization_SettingsStore.objects.filter(key='test').update(value='changed')
+            yield batch
+
+    monkeypatch.setattr(CompactCommand, '_batches', changing_batches)
+    out = StringIO()
+    call_command('hierarkey_compact', namespace=['organization'], stdout=out)
+    assert 'organization: deleted 1 of 3 values.' in out.getvalue()
+    assert set(Organization_SettingsStore.objects.values_list('key', flat=True)) == {'test', 'other'}
+    assert Organization.objects.get(pk=redundant.organization.pk).settings.test == 'changed'
@@ -0,0 +1,88 @@
+import pytest
+
+from hierarkey.proxy import KeyNotLoaded
+
+from .testapp.models import User, hierarkey
+
+
+@pytest.fixture
+def groups():
+    olddef = hierarkey.defaults
+    hierarkey.defaults = dict(olddef)
+    hierarkey.add_default('checkout_enabled', 'True', bool, group='checkout')
+    hierarkey.add_default('checkout_limit', '3', int, group='checkout')
+    hierarkey.add_default('payment_provider', 'bank', str, group='payment')
+    yield
+    hierarkey.defaults = olddef
+
+
+@pytest.mark.django_db
+def test_group_keys(groups):
+    assert hierarkey.get_groups() == {'checkout', 'payment'}
+    assert hierarkey.get_group_keys('checkout') == ['checkout_enabled', 'checkout_limit']
+    with pytest.raises(ValueError):
+        hierarkey.get_group_keys('unknown')
+
+
+@pytest.mark.django_db
+def test_restricted_load(groups, user, django_assert_num_queries):
+    user.organization.settings.checkout_limit = 5
+    user.settings.payment_provider = 'card'
+    user.settings.unrelated = 'foo'
+
+    user = User.objects.get(pk=user.pk)
+    with django_assert_num_queries(4):
+        # The user's storage, the organization, the organization's storage and the global storage
+        settings = user.settings.only('checkout')
+        assert settings.checkout_enabled is True
+        assert settings.checkout_limit == 5
+    assert settings._cache() == {}
+    assert settings.freeze() == {'checkout_enabled': True, 'checkout_limit': 5}
+    with pytest.raises(KeyNotLoaded):
+        settings.get('payment_provider')
+    with pytest.raises(KeyNotLoaded):
+        settings.unrelated
+
+    assert user.settings.only('payment', 'checkout').payment_provider == 'card'
+
+    user = User.objects.get(pk=user.pk)
+    with django_assert_num_queries(1):
+        # Only the organization is fetched, everything else is cached
+        assert user.settings.only('checkout').checkout_limit == 5
+
+
+@pytest.mark.django_db
+def test_restricted_invalidation(groups, user):
+    assert user.settings.only('checkout').checkout_limit == 3
+    user.settings.checkout_limit = 7
+    assert user.settings.only('checkout').checkout_limit == 7
+
+    user = User.objects.get(pk=user.pk)
+    assert user.settings.only('checkout').checkout_limit == 7
+    user.settings.delete('checkout_limit')
+    user = User.objects.get(pk=user.pk)
+    assert user.settings.only('checkout').checkout_limit == 3
+
+
+@pytest.mark.django_db
+def test_restricted_writes_update_origin(groups, user):
+    organization = user.organization
+    organization.settings.set('checkout_limit', 5)
+    assert organization.settings.checkout_limit == 5
+    restricted = organization.settings.only('checkout')
+    assert restricted.only('payment') is organization.settings.only('payment')
+
+    restricted.set('checkout_limit', 6)
+    assert organization.settings.checkout_limit == 6
+    assert user.settings.checkout_limit == 6
+    assert restricted.increment('checkout_limit') == 7
+    assert organization.settings.checkout_limit == 7
+    assert restricted.compare_and_set('checkout_limit', 7, 8)
+    assert organization.settings.checkout_limit == 8
+    with restricted.batch():
+        restricted.set('checkout_limit', 9)
+        restricted.checkout_enabled = False
+    assert (organization.settings.checkout_limit, organization.settings.checkout_enabled) == (9, False)
+    restricted.delete('checkout_limit')
+    assert organization.settings.checkout_limit == 3
+    assert user.settings.checkout_limit == 3
@@ -0,0 +1,120 @@
+import pytest
+from django.core.cache import caches
+
+from hierarkey.invalidation import GenerationTracker, LocalBroker
+from hierarkey.invalidation.models import Generation
+
+from .testapp.models import (
+    GlobalSettings, GlobalSettings_SettingsStore, Organization, User,
+    hierarkey,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    # Cache entries and counters of earlier tests would otherwise be found under the same keys
+    caches['default'].clear()
+    caches['local'].clear()
+    yield
+    caches['default'].clear()
+    caches['local'].clear()
+
+
+@pytest.fixture
+def tracker():
+    hierarkey.invalidation = GenerationTracker(broker=LocalBroker(), check_interval=None)
+    yield hierarkey.invalidation
+    hierarkey.invalidation = None
+
+
+@pytest.mark.django_db
+def test_change_in_other_instance(tracker, user):
+    assert user.settings.test is None
+    organization = Organization.objects.get(pk=user.organization.pk)
+    organization.settings.test = 'foo'
+    assert user.settings.test == 'foo'
+    assert user.organization.settings.test == 'foo'
+    organization.settings.test = 'bar'
+    assert user.settings.test == 'bar'
+    assert user.settings.freeze()['test'] == 'bar'
+
+
+@pytest.mark.django_db
+def test_no_reload_without_changes(tracker, user, django_assert_num_queries):
+    user.settings.test = 'foo'
+    assert user.settings.test == 'foo'
+    assert user.settings.test2 is None
+    with django_assert_num_queries(0):
+        assert user.settings.test == 'foo'
+        assert user.settings.test2 is None
+
+
+@pytest.mark.django_db
+def test_patch_cache_entry(tracker, user, django_assert_num_queries):
+    user.settings.set('other', 'foo')
+    assert User(pk=user.pk).settings.state is None
+    assert user.settings.compare_and_set('state', None, 'new')
+    assert user.settings._cache_backend.get(user.settings._cache_key) == {'other': 'foo', 'state': 'new'}
+
+    other = User.objects.select_related('organization').get(pk=user.pk)
+    other.organization.settings.freeze()
+    with django_assert_num_queries(0):
+        assert other.settings.state == 'new'
+
+
+@pytest.mark.django_db
+def test_local_cache_entries(tracker):
+    settings = GlobalSettings().settings
+    settings.set('x', 'old')
+    assert GlobalSettings().settings.x == 'old'
+    # Simulate a change made by another process, which cannot delete this process' local cache entries
+    GlobalSettings_SettingsStore.objects.filter(key='x').update(value='new')
+    tracker.bump('global', '_global')
+    assert settings.x == 'new'
+    assert GlobalSettings().settings.x == 'new'
+    settings.delete('x')
+
+
+@pytest.mark.django_db
+def test_polling_without_broker(user):
+    hierarkey.invalidation = GenerationTracker(check_interval=0)
+    try:
+        assert user.settings.test is None
+        other = User.objects.get(pk=user.pk)
+        other.settings.test = 'foo'
+        # Simulate another process by forgetting what this process knows
+        hierarkey.invalidation._known.clear()
+        assert user.settings.test == 'foo'
+    finally:
+        hierarkey.invalidation = None
+
+
+def test_known_generations_bounded():
+    tracker = GenerationTracker(check_interval=None, max_known=2)
+    first = tracker.current('organization', 1)
+    tracker.current('organization', 2)
+    tracker.bump('organization', 3)
+    assert list(tracker._known) == [('organization', 2), ('organization', 3)]
+    assert tracker.current('organization', 1) == first
+    assert list(tracker._known) == [('organization', 3), ('organization', 1)]
+
+
+@pytest.mark.django_db
+def test_database_generations():
+    tracker = GenerationTracker(use_database=True)
+    first = tracker.bump('organization', 42)
+    assert tracker.bump('organization', 42) == first + 1
+    assert Generation.objects.get(namespace='organization', object_pk='42').generation == first + 1
+
+    caches['default'].delete(tracker._cache_key('organization', 42))
+    tracker._known.clear()
+    assert tracker.current('organization', 42) == first + 1
+
+
+def test_cache_generations_restart_after_eviction():
+    tracker = GenerationTracker()
+    first = tracker.bump('organization', 43)
+    assert tracker.current('organization', 43) == first
+    caches['default'].delete(tracker._cache_key('organization', 43))
+    tracker._known.clear()
+    assert tracker.current('organization', 43) > first
@@ -0,0 +1,45 @@
+import pytest
+import tracemalloc
+
+from .testapp.models import Organization
+
+
+@pytest.fixture
+def organization():
+    o = Organization.objects.create(name='Foo')
+    o.settings.flush()
+    for i in range(20):
+        o.settings.set('key_%d' % i, 'value')
+    o.settings.flush()
+    return o
+
+
+@pytest.mark.django_db
+def test_proxy_has_no_instance_dict(organization):
+    assert not hasattr(organization.settings, '__dict__')
+
+
+@pytest.mark.django_db
+def test_keys_are_interned(organization):
+    first = Organization.objects.get(pk=organization.pk).settings._cache()
+    second = Organization.objects.get(pk=organization.pk).settings._cache()
+    assert all(a is b for a, b in zip(sorted(first), sorted(second)))
+
+
+@pytest.mark.django_db
+def test_memory_per_loaded_object(organization):
+    instances = [Organization(pk=organization.pk, name='Foo') for i in range(1000)]
+    instances[0].settings.get('key_1')
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for instance in instances[1:]:
+            instance.settings.get('key_1')
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    per_object = sum(stat.size_diff for stat in after.compare_to(before, 'filename')) / (len(instances) - 1)
+    # Storage objects with a __dict__, a WeakSet of dependents and non-interned keys used about 3.9 kB here
+    assert per_object < 2500
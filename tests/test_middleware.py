@@ -0,0 +1,42 @@
+import pytest
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from hierarkey.middleware import SharedStorageMiddleware
+from hierarkey.proxy import shared_storage
+
+from .testapp.models import Organization, User
+
+
+@pytest.mark.django_db
+def test_shared_storage(user, django_assert_num_queries):
+    user.organization.settings.test = 'foo'
+    user.organization.settings.flush()
+
+    with shared_storage():
+        organization = Organization.objects.get(pk=user.organization.pk)
+        user = User.objects.select_related('organization').get(pk=user.pk)
+        with django_assert_num_queries(1):
+            assert organization.settings.test == 'foo'
+            assert user.organization.settings.test == 'foo'
+        assert organization.settings is user.organization.settings
+
+        organization.settings.test = 'bar'
+        assert user.organization.settings.test == 'bar'
+        assert user.settings.test == 'bar'
+
+    organization = Organization.objects.get(pk=user.organization.pk)
+    assert organization.settings is not user.organization.settings
+
+
+@pytest.mark.django_db
+def test_shared_storage_middleware(user):
+    proxies = []
+
+    def view(request):
+        proxies.append(Organization.objects.get(pk=user.organization.pk).settings)
+        proxies.append(Organization.objects.get(pk=user.organization.pk).settings)
+        return HttpResponse()
+
+    SharedStorageMiddleware(view)(RequestFactory().get('/'))
+    assert proxies[0] is proxies[1]
@@ -0,0 +1,44 @@
+import pytest
+from types import SimpleNamespace
+
+from hierarkey import stats
+
+from .testapp.models import Organization, User
+
+pytest.importorskip('debug_toolbar')
+
+from hierarkey.panels import HierarkeyPanel, summarize  # NOQA
+
+
+@pytest.fixture
+def panel():
+    toolbar = SimpleNamespace(stats={}, request_id='1', store=SimpleNamespace(save_panel=lambda *args: None))
+    return HierarkeyPanel(toolbar, lambda request: None)
+
+
+@pytest.mark.django_db
+def test_panel(panel):
+    organization = Organization.objects.create(name='Foo')
+    organization.settings.set('test', '<b>')
+    organization.settings.flush()
+    User.objects.create(organization=organization, name='Bar')
+
+    panel.enable_instrumentation()
+    for user in User.objects.all():
+        assert user.settings.test == '<b>'
+        assert Organization.objects.get(pk=organization.pk).settings.test == '<b>'
+    panel.disable_instrumentation()
+    assert stats.collectors == ()
+
+    panel.generate_stats(None, None)
+    data = panel.get_stats()
+    assert {(p['namespace'], p['count']) for p in data['proxies']} == {('user', 1), ('organization', 2)}
+    assert [r['level'] for r in data['reads']] == ['organization', 'organization']
+    assert data['duplicates'] == [{'namespace': 'organization', 'pk': str(organization.pk), 'count': 2}]
+    assert panel.nav_subtitle == '2 reads, 2 cache misses, 2 loads'
+    assert organization.settings._cache_key in panel.content
+    assert 'Fetched more than once' in panel.content
+
+
+def test_summarize_empty():
+    assert summarize([]) == {'proxies': [], 'lookups': [], 'loads': [], 'reads': [], 'duplicates': []}
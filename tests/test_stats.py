@@ -0,0 +1,101 @@
+import contextvars
+import pytest
+
+from hierarkey import stats
+
+from .testapp.models import Organization, User
+
+
+@pytest.fixture
+def collector():
+    collector = stats.CounterCollector()
+    stats.register(collector)
+    yield collector
+    stats.unregister(collector)
+
+
+@pytest.fixture
+def organization():
+    organization = Organization.objects.create(name='Foo')
+    organization.settings.flush()
+    return organization
+
+
+@pytest.mark.django_db
+def test_cache_miss_and_hit(organization, collector):
+    organization.settings.set('test', 'foo')
+    collector.reset()
+
+    assert Organization.objects.get(pk=organization.pk).settings.test == 'foo'
+    assert collector.counters['organization', 'cache_miss'] == 1
+    assert collector.counters['organization', 'db_load'] == 1
+    assert collector.counters['organization', 'db_rows'] == 1
+    assert collector.timings['organization', 'db_load'] > 0
+
+    assert Organization.objects.get(pk=organization.pk).settings.test == 'foo'
+    assert collector.counters['organization', 'cache_hit'] == 1
+    assert collector.counters['organization', 'db_load'] == 1
+    assert ('organization', 'decode') in collector.timings
+    assert ('organization', 'unserialize') in collector.timings
+
+
+@pytest.mark.django_db
+def test_writes(organization, collector):
+    organization.settings.set('test', 'foo')
+    assert collector.counters['organization', 'write'] == 1
+    assert collector.counters['organization', 'invalidate'] == 1
+    assert ('organization', 'serialize') in collector.timings
+
+    organization.settings.delete('test')
+    assert collector.counters['organization', 'delete'] == 1
+    assert collector.counters['organization', 'invalidate'] == 2
+
+
+@pytest.mark.django_db
+def test_context(organization):
+    calls = []
+
+    class Recorder(stats.StatsCollector):
+        def incr(self, metric, namespace, value=1, **context):
+            calls.append((metric, namespace, context))
+
+    recorder = Recorder()
+    stats.register(recorder)
+    try:
+        organization.settings.set('test', 'foo')
+    finally:
+        stats.unregister(recorder)
+    assert ('write', 'organization', {'pk': organization.pk, 'key': 'test'}) in calls
+
+    organization.settings.set('test', 'bar')
+    assert len([c for c in calls if c[0] == 'write']) == 1
+    assert stats.collectors == ()
+
+
+@pytest.mark.django_db
+def test_recording(organization):
+    user = User.objects.create(organization=organization, name='Bar')
+    organization.settings.set('test', 'foo')
+    recorder = stats.RecordingCollector()
+    recorder.start()
+    try:
+        user = User.objects.select_related('organization').get(pk=user.pk)
+        assert user.settings.test == 'foo'
+    finally:
+        recorder.stop()
+    assert stats.collectors == ()
+
+    reads = [e for e in recorder.events if e.metric == 'read']
+    assert reads == [stats.StatsEvent('incr', 'read', 'user', 1, {'pk': user.pk, 'key': 'test', 'level': 'organization'})]
+    assert {e.namespace for e in recorder.events if e.metric == 'proxy_created'} == {'user', 'organization'}
+
+
+def test_recording_other_context():
+    recorder = stats.RecordingCollector()
+    recorder.start()
+    try:
+        contextvars.Context().run(stats.incr, 'write', 'organization')
+        stats.incr('write', 'user')
+    finally:
+        recorder.stop()
+    assert [e.namespace for e in recorder.events] == ['user']
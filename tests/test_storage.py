@@ -1,14 +1,23 @@
+import pickle
 from datetime import date, datetime, time
 from decimal import Decimal
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
 from django.core.files import File
 from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.signals import request_started
 from django.test import TestCase
 from django.utils.timezone import now
+from unittest import mock
 
+from hierarkey.invalidation import GenerationTracker, LocalBroker
 from hierarkey.models import HierarkeyDefault
+from hierarkey.proxy import HierarkeyProxy
 
-from .testapp.models import GlobalSettings, Organization, User, hierarkey
+from .testapp.models import (
+    GlobalSettings, Organization, Organization_SettingsStore, User, hierarkey,
+)
 
 
 class MyType:
@@ -94,6 +103,28 @@ class SettingsTestCase(TestCase):
         self.assertEqual(self.organization.settings.test, 'foo')
         self.assertEqual(self.user.settings.test, 'foo')
 
+    def test_resolution_is_remembered(self):
+        self.global_settings.settings.test = 'foo'
+        self.assertEqual(self.user.settings.test, 'foo')
+        self.assertIsNone(self.user.settings.nonexisting)
+        self.assertEqual(self.user.settings._resolved, {'test': 'foo', 'nonexisting': None})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.user.settings.test, 'foo')
+            self.assertEqual(self.user.settings.test_default, 'def')
+
+    def test_resolution_invalidated_by_parent(self):
+        self.assertIsNone(self.user.settings.test)
+        self.user.organization.settings.test = 'foo'
+        self.assertEqual(self.user.settings.test, 'foo')
+        self.assertIsNone(self.user.settings.test2)
+        self.global_settings = self.user.organization.settings._parent
+        self.global_settings.settings.test2 = 'bar'
+        self.assertEqual(self.user.settings.test2, 'bar')
+        del self.user.organization.settings.test
+        self.assertIsNone(self.user.settings.test)
+        self.global_settings.settings.test2 = 'baz'
+        self.assertEqual(self.user.settings.test2, 'baz')
+
     def test_user_override_organization(self):
         self.organization.settings.test = 'foo'
         self.user.settings.test = 'bar'
@@ -157,6 +188,17 @@ class SettingsTestCase(TestCase):
         self.global_settings = GlobalSettings()
         self.assertIsNone(self.global_settings.settings.testglobal)
 
+    def test_cache_alias_per_level(self):
+        self.global_settings.settings.test = 'foo'
+        self.organization.settings.test = 'bar'
+        self.assertEqual(GlobalSettings().settings.test, 'foo')
+        self.assertEqual(Organization.objects.get(pk=self.organization.pk).settings.test, 'bar')
+
+        global_key = GlobalSettings().settings._cache_key
+        self.assertEqual(caches['local'].get(global_key), {'test': 'foo'})
+        self.assertIsNone(caches['default'].get(global_key))
+        self.assertEqual(caches['default'].get(self.organization.settings._cache_key), {'test': 'bar'})
+
     def test_serialize_str(self):
         self._test_serialization('ABC', as_type=str)
 
@@ -296,3 +338,210 @@ class SettingsTestCase(TestCase):
             })
         finally:
             hierarkey.defaults = olddef
+
+    def test_precompiled_defaults(self):
+        olddef = hierarkey.defaults
+        hierarkey.defaults = dict(olddef)
+        try:
+            hierarkey.add_default('test_list', '[1, 2]', list)
+            hierarkey.add_default('test_decimal', '1.50', Decimal)
+            hierarkey.add_default('test_date', '2024-05-01', date)
+
+            value = self.user.settings.test_list
+            self.assertEqual(value, [1, 2])
+            value.append(3)
+            self.assertEqual(self.user.settings.test_list, [1, 2])
+            self.assertEqual(self.user.settings.freeze()['test_list'], [1, 2])
+            self.assertIs(self.user.settings.test_decimal, self.organization.settings.test_decimal)
+            self.assertEqual(self.user.settings.test_date, date(2024, 5, 1))
+            self.assertEqual(self.user.settings.get('test_decimal', as_type=str), '1.50')
+
+            # Changing the declaration directly is picked up as well
+            hierarkey.defaults['test_decimal'] = HierarkeyDefault('2.50', Decimal)
+            self.assertEqual(self.user.settings.test_decimal, Decimal('2.50'))
+        finally:
+            hierarkey.defaults = olddef
+
+    def test_key_accessors(self):
+        olddef = hierarkey.defaults
+        hierarkey.defaults = dict(olddef)
+        try:
+            hierarkey.add_default('test_int', '3', int)
+            hierarkey.add_default('test_none', None, int)
+            hierarkey.add_default('flush', 'True', bool)
+            self.user = User.objects.get(pk=self.user.pk)
+            proxy_class = type(self.user.settings)
+            self.assertIn('test_int', vars(proxy_class))
+            self.assertNotIn('flush', vars(proxy_class))
+            self.assertEqual(proxy_class.__slots__, ())
+
+            self.assertEqual(self.user.settings.test_int, 3)
+            self.assertIsNone(self.user.settings.test_none)
+            self.user.organization.settings.test_int = 5
+            self.assertEqual(self.user.settings.test_int, 5)
+            self.user.settings.test_int = 7
+            self.assertEqual(self.user.settings.test_int, 7)
+            del self.user.settings.test_int
+            self.assertEqual(self.user.settings.test_int, 5)
+            self.assertEqual(self.user.settings.get('flush', as_type=bool), True)
+            self.assertTrue(callable(self.user.settings.flush))
+
+            # Changing the declaration directly is picked up as well
+            hierarkey.defaults['test_none'] = HierarkeyDefault('1', int)
+            self.assertEqual(self.user.settings.test_none, 1)
+        finally:
+            hierarkey.defaults = olddef
+
+    def test_pickle(self):
+        self.user.settings.test = 'foo'
+        self.assertEqual(self.user.settings.test, 'foo')
+        user = pickle.loads(pickle.dumps(self.user))
+        self.assertIsInstance(user.settings, type(self.user.settings))
+        self.assertIsNone(user.settings._cached_obj)
+        self.assertIs(user.settings._obj, user)
+        self.assertEqual(user.settings.test, 'foo')
+        self.assertEqual(user.settings._parent.pk, self.organization.pk)
+
+    def test_invalid_default(self):
+        olddef = hierarkey.defaults
+        oldtypes = hierarkey.types
+        hierarkey.defaults = dict(olddef)
+        hierarkey.types = list(oldtypes)
+        try:
+            with self.assertRaises(ImproperlyConfigured):
+                hierarkey.add_default('test_int', 'foo', int)
+            with self.assertRaises(ImproperlyConfigured):
+                hierarkey.add_default('test_dict', '{foo', dict)
+            with self.assertRaises(ImproperlyConfigured):
+                hierarkey.add_default('test_datetime', 'yesterday', datetime)
+            self.assertNotIn('test_int', hierarkey.defaults)
+
+            # Custom types are not unserialized when they are declared
+            class Lazy:
+                pass
+
+            hierarkey.add_default('test_lazy', 'foo', Lazy)
+            hierarkey.add_type(Lazy, str, lambda v: 1 / 0)
+            with self.assertRaises(ZeroDivisionError):
+                self.user.settings.test_lazy
+        finally:
+            hierarkey.defaults = olddef
+            hierarkey.types = oldtypes
+
+
+class ReadReplicaTestCase(TestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        hierarkey.read_using = 'replica'
+        caches['default'].clear()
+        self.organization = Organization.objects.create(name='Dummy')
+        Organization.objects.using('replica').create(pk=self.organization.pk, name='Dummy')
+        Organization_SettingsStore.objects.using('replica').create(
+            object_id=self.organization.pk, key='test', value='replica'
+        )
+        request_started.send(sender=self.__class__)
+
+    def tearDown(self):
+        hierarkey.read_using = None
+
+    def test_load_from_replica(self):
+        self.organization.settings.flush()
+        self.assertEqual(self.organization.settings.test, 'replica')
+
+    def test_read_primary_after_write(self):
+        self.organization.settings.flush()
+        self.organization.settings.test = 'primary'
+
+        self.organization = Organization.objects.get(pk=self.organization.pk)
+        self.assertEqual(self.organization.settings.test, 'primary')
+
+        # Other processes and later requests load from the primary as well until the replica caught up
+        request_started.send(sender=self.__class__)
+        self.organization = Organization.objects.get(pk=self.organization.pk)
+        self.organization.settings.flush()
+        self.assertEqual(self.organization.settings.test, 'primary')
+
+        caches['default'].delete(self.organization.settings._written_key)
+        self.organization = Organization.objects.get(pk=self.organization.pk)
+        self.organization.settings.flush()
+        self.assertEqual(self.organization.settings.test, 'replica')
+
+    def test_read_primary_after_bulk_write(self):
+        self.organization.settings.flush()
+        hierarkey.set_for_queryset(Organization.objects.filter(pk=self.organization.pk), 'test', 'primary')
+        self.organization = Organization.objects.get(pk=self.organization.pk)
+        self.assertEqual(self.organization.settings.test, 'primary')
+
+    def test_written_during_load(self):
+        self.organization.settings.flush()
+        Organization_SettingsStore.objects.create(object=self.organization, key='test', value='primary')
+        original = HierarkeyProxy._load_using
+
+        def load_using(proxy, using, keys=None):
+            if using == 'replica':
+                # Simulates a write in another process while the values are loaded from the replica
+                caches['default'].set(proxy._written_key, True)
+            return original(proxy, using, keys)
+
+        with mock.patch.object(HierarkeyProxy, '_load_using', load_using):
+            self.assertEqual(self.organization.settings.test, 'primary')
+
+
+class SnapshotTestCase(TestCase):
+    def setUp(self):
+        hierarkey.add_default('test_default', 'def', str)
+        self.organization = Organization.objects.create(name='Dummy')
+        self.organization.settings.flush()
+        self.user = User.objects.create(organization=self.organization, name='Dummy')
+        self.user.settings.flush()
+
+    def test_snapshot_values(self):
+        self.organization.settings.test = 'foo'
+        self.user.settings.set('number', 42)
+        snapshot = self.user.settings.snapshot()
+
+        self.assertEqual(snapshot.test, 'foo')
+        self.assertEqual(snapshot['test_default'], 'def')
+        self.assertEqual(snapshot.get('number', as_type=int), 42)
+        self.assertIsNone(snapshot.nonexisting)
+        self.assertEqual(snapshot.get('nonexisting', default='abc'), 'abc')
+        with self.assertRaises(KeyError):
+            snapshot['nonexisting']
+        self.assertIn('test', snapshot)
+        self.assertEqual(dict(snapshot)['number'], '42')
+
+    def test_snapshot_immutable(self):
+        snapshot = self.user.settings.snapshot()
+        self.user.settings.test = 'bar'
+        self.assertIsNone(snapshot.test)
+        with self.assertRaises(TypeError):
+            snapshot.test = 'foo'
+        with self.assertRaises(TypeError):
+            snapshot['test'] = 'foo'
+        with self.assertRaises(TypeError):
+            del snapshot.test
+
+    def test_snapshot_hash_and_equality(self):
+        self.user.settings.test = 'foo'
+        first = self.user.settings.snapshot()
+        second = User.objects.get(pk=self.user.pk).settings.snapshot()
+        self.assertEqual(first, second)
+        self.assertEqual(hash(first), hash(second))
+        self.assertEqual(len({first, second}), 1)
+
+        self.user.settings.test = 'bar'
+        self.assertNotEqual(first, self.user.settings.snapshot())
+
+    def test_snapshot_generation(self):
+        self.assertFalse(self.user.settings.snapshot().is_current())
+        hierarkey.invalidation = GenerationTracker(broker=LocalBroker(), check_interval=None)
+        try:
+            snapshot = self.user.settings.snapshot()
+            self.assertEqual(len(snapshot.generation), 3)
+            self.assertTrue(snapshot.is_current())
+            Organization.objects.get(pk=self.organization.pk).settings.test = 'foo'
+            self.assertFalse(snapshot.is_current())
+            self.assertEqual(self.user.settings.snapshot().test, 'foo')
+        finally:
+            hierarkey.invalidation = None
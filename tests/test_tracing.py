@@ -0,0 +1,59 @@
+import pytest
+
+from .testapp.models import Organization, User
+
+pytest.importorskip('opentelemetry.sdk')
+
+from opentelemetry import trace  # NOQA
+from opentelemetry.sdk.trace import TracerProvider  # NOQA
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor  # NOQA
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import \
+    InMemorySpanExporter  # NOQA
+
+exporter = InMemorySpanExporter()
+
+
+@pytest.fixture(scope='module', autouse=True)
+def provider():
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+
+
+@pytest.fixture
+def spans():
+    exporter.clear()
+    yield lambda name: [s for s in exporter.get_finished_spans() if s.name == name]
+    exporter.clear()
+
+
+@pytest.mark.django_db
+def test_fetch(user, spans):
+    user.organization.settings.set('test', 'foo')
+    assert Organization.objects.get(pk=user.organization.pk).settings.test == 'foo'
+    exporter.clear()
+
+    user = User.objects.select_related('organization').get(pk=user.pk)
+    assert user.settings.test == 'foo'
+    fetch = {s.attributes['hierarkey.namespace']: s for s in spans('hierarkey.fetch')}
+    assert fetch['user'].attributes['hierarkey.pk'] == user.pk
+    assert fetch['user'].attributes['hierarkey.cache_hit'] is False
+    assert fetch['user'].attributes['hierarkey.key_count'] == 0
+    assert fetch['organization'].attributes['hierarkey.cache_hit'] is True
+    assert fetch['organization'].attributes['hierarkey.key_count'] == 1
+    assert [s.attributes['hierarkey.namespace'] for s in spans('hierarkey.load')] == ['user']
+
+    resolve, = spans('hierarkey.resolve')
+    assert resolve.attributes['hierarkey.key'] == 'test'
+    assert fetch['organization'].parent.span_id == resolve.context.span_id
+
+
+@pytest.mark.django_db
+def test_writes(user, spans):
+    user.settings.set('test', 'foo')
+    user.settings.delete('test')
+    set_span, = spans('hierarkey.set')
+    delete_span, = spans('hierarkey.delete')
+    assert set_span.attributes['hierarkey.namespace'] == 'user'
+    assert set_span.attributes['hierarkey.key'] == 'test'
+    assert delete_span.attributes['hierarkey.key'] == 'test'
@@ -0,0 +1,114 @@
+import pytest
+import zlib
+from django.db import transaction
+
+from hierarkey import writebehind
+from hierarkey.models import HierarkeyCache
+from hierarkey.proxy import HierarkeyProxy
+
+from .testapp.models import (
+    GlobalSettings, GlobalSettings_SettingsStore, Organization_SettingsStore,
+    User, User_SettingsStore, hierarkey,
+)
+
+
+@pytest.fixture(autouse=True)
+def last_seen(user):
+    olddef = hierarkey.defaults
+    hierarkey.defaults = dict(olddef)
+    hierarkey.add_default('last_seen', None, write_behind=True)
+    yield
+    writebehind.discard(User_SettingsStore, user.pk, 'last_seen')
+    writebehind.discard(GlobalSettings_SettingsStore, GlobalSettings.pk, 'last_seen')
+    hierarkey.defaults = olddef
+
+
+@pytest.mark.django_db
+def test_write_behind(user, django_assert_num_queries, django_capture_on_commit_callbacks):
+    user.settings.set('other', 'foo')
+    assert User(pk=user.pk).settings.last_seen is None
+    cache_key = user.settings._cache_key
+    cached = user.settings._cache_backend.get(cache_key)
+
+    with django_assert_num_queries(0):
+        for i in range(10):
+            user.settings.last_seen = str(i)
+        assert user.settings.last_seen == '9'
+        assert User(pk=user.pk).settings.last_seen == '9'
+    assert user.settings._cache_backend.get(cache_key) == cached
+    assert not User_SettingsStore.objects.filter(key='last_seen').exists()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        writebehind.flush()
+    assert User_SettingsStore.objects.filter(key='last_seen').get().value == '9'
+    assert user.settings._cache_backend.get(cache_key) is None
+    assert User(pk=user.pk).settings.last_seen == '9'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_write_behind_interval(user, monkeypatch):
+    monkeypatch.setattr(writebehind, 'FLUSH_INTERVAL', 0)
+    user.settings.last_seen = 'now'
+    assert User_SettingsStore.objects.filter(key='last_seen').get().value == 'now'
+    assert writebehind.pending(User_SettingsStore, user.pk) == {}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_write_behind_rollback(user, monkeypatch):
+    monkeypatch.setattr(writebehind, 'FLUSH_INTERVAL', 0)
+    with pytest.raises(ValueError):
+        with transaction.atomic():
+            user.settings.last_seen = 'now'
+            raise ValueError()
+    assert not User_SettingsStore.objects.filter(key='last_seen').exists()
+    assert writebehind.pending(User_SettingsStore, user.pk) == {'last_seen': 'now'}
+    writebehind.flush()
+    assert User_SettingsStore.objects.filter(key='last_seen').get().value == 'now'
+
+
+@pytest.mark.django_db
+def test_write_behind_superseded(user):
+    user.settings.last_seen = 'yesterday'
+    del user.settings.last_seen
+    assert writebehind.pending(User_SettingsStore, user.pk) == {}
+
+    user.settings.last_seen = 'today'
+    with user.settings.batch():
+        user.settings.last_seen = 'tomorrow'
+    writebehind.flush()
+    assert User_SettingsStore.objects.filter(key='last_seen').get().value == 'tomorrow'
+
+
+@pytest.mark.django_db
+def test_write_behind_global(user):
+    GlobalSettings().settings.last_seen = 'now'
+    assert user.settings.last_seen == 'now'
+    writebehind.flush()
+    assert GlobalSettings_SettingsStore.objects.filter(key='last_seen').get().value == 'now'
+    GlobalSettings().settings.delete('last_seen')
+
+
+@pytest.mark.django_db
+def test_write_behind_sharded(user, django_assert_num_queries):
+    config = HierarkeyCache(alias='default', timeout=60, prefix='sharded', codec=None, shards=4)
+
+    def proxy():
+        return HierarkeyProxy._new(user.organization, hierarkey=hierarkey, cache_namespace='organization',
+                                   type=Organization_SettingsStore, cache=config)
+
+    # A key in another bucket than the write-behind key, so that its bucket is not loaded when writing
+    other = next('key_%d' % i for i in range(20)
+                 if zlib.crc32(('key_%d' % i).encode()) % 4 != zlib.crc32(b'last_seen') % 4)
+    proxy().set(other, 'foo')
+    assert proxy().get(other) == 'foo'
+
+    try:
+        settings = proxy()
+        with django_assert_num_queries(0):
+            assert settings.get(other) == 'foo'
+            settings.last_seen = 'now'
+            assert settings.last_seen == 'now'
+            assert proxy().last_seen == 'now'
+            assert proxy().freeze()['last_seen'] == 'now'
+    finally:
+        writebehind.discard(Organization_SettingsStore, user.organization.pk, 'last_seen')
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:27
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='globalsettings_settingsstore',
+            unique_together={('key',)},
+        ),
+        migrations.AlterUniqueTogether(
+            name='organization_settingsstore',
+            unique_together={('object', 'key')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='user_settingsstore',
+            unique_together={('object', 'key')},
+        ),
+    ]
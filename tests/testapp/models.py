@@ -6,7 +6,7 @@ from hierarkey.models import GlobalSettingsBase, Hierarkey
 hierarkey = Hierarkey(attribute_name='settings')
 
 
-@hierarkey.set_global(cache_namespace='global')
+@hierarkey.set_global(cache_namespace='global', cache_alias='local', cache_timeout=None)
 class GlobalSettings(GlobalSettingsBase):
     pass
 